@@ -0,0 +1,410 @@
+"""
+Load-testing harness for the three brevet services.
+
+Drives flask_app (brevet), api (brevet_api) and auth_ui (brevet_ui)
+with a mix of realistic traffic -- control recalculations, submits,
+logins and list/CSV polling -- and reports requests/sec and
+p50/p95/p99 latency per route as JSON, so runs can be compared across
+commits.
+
+Modes:
+  inprocess  import the apps and drive them through Flask's test client,
+             against mongomock (default) or a real mongod (--mongo URL)
+  gunicorn   start each service under gunicorn on a local port and
+             drive it over HTTP; needs --mongo pointing at a mongod
+
+USE: python benchmark/loadtest.py --duration 10 --workers 4 -o before.json
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# service name -> (directory, module, gunicorn port)
+SERVICES = {
+    'brevet': ('brevet', 'flask_app', 8102),
+    'api': ('brevet_api', 'api', 8101),
+    'ui': ('brevet_ui', 'auth_ui', 8100),
+}
+
+# flask_app reads its configuration from app.ini in the working
+# directory; both modes run the services from a directory holding this.
+BENCH_INI = """[DEFAULT]
+SECRET_KEY = loadtest
+DEBUG = False
+PORT = 5000
+"""
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+BREVET_DISTANCES = [200, 300, 400, 600, 1000]
+
+
+#########
+# Clients
+#########
+
+class InProcessClient:
+    """Sends requests through a Flask test client (keeps cookies)."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class HttpClient:
+    """Sends requests to a running service over HTTP (keeps cookies)."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(cookies))
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data, doseq=True).encode() if data else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as err:
+            return err.code, err.read().decode()
+
+
+###########
+# Scenarios
+#   Each scenario takes (clients, rider) and returns a route label.
+#   Every request goes through Session.timed so it is measured.
+###########
+
+def random_start():
+    return '2018-0{}-1{}'.format(random.randint(1, 9), random.randint(0, 9))
+
+
+def calc_times(session):
+    dist = random.choice(BREVET_DISTANCES)
+    query = urllib.parse.urlencode({
+        'km': round(random.uniform(0, dist), 1),
+        'brev_dist_km': dist,
+        'start_date': random_start(),
+        'start_time': '06:00'
+    })
+    session.timed('brevet', 'GET /_calc_times', 'GET', '/_calc_times?' + query)
+
+
+def submit_brevet(session):
+    dist = random.choice(BREVET_DISTANCES)
+    kms = sorted(random.sample(range(0, dist + 1), random.randint(3, 20)))
+    form = {
+        'km': kms,
+        'location': ['Control {}'.format(i) for i in range(len(kms))],
+        'distance': dist,
+        'begin_date': random_start(),
+        'begin_time': '06:00'
+    }
+    session.timed('brevet', 'POST /_submit_to_db', 'POST', '/_submit_to_db', form)
+
+
+def view_db(session):
+    session.timed('brevet', 'GET /db', 'GET', '/db')
+
+
+def api_list_json(session):
+    session.timed('api', 'GET /listAll/json', 'GET', '/listAll/json')
+
+
+def api_list_csv(session):
+    session.timed('api', 'GET /listOpenOnly/csv?top', 'GET',
+                  '/listOpenOnly/csv?top={}'.format(random.randint(1, 20)))
+
+
+def api_login(session):
+    session.timed('api', 'POST /api/login', 'POST', '/api/login', session.credentials)
+
+
+def ui_list_json(session):
+    session.timed('ui', 'GET /_listAll/json', 'GET', '/_listAll/json')
+
+
+def ui_list_csv(session):
+    session.timed('ui', 'GET /_listCloseOnly/csv?top', 'GET',
+                  '/_listCloseOnly/csv?top={}'.format(random.randint(1, 20)))
+
+
+def ui_login(session):
+    session.ui_form('GET /login', 'POST /login', '/login')
+
+
+# (service, scenario, weight) -- weights approximate production traffic:
+# mostly recalcs while organisers type, and dashboards polling lists.
+TRAFFIC = [
+    ('brevet', calc_times, 50),
+    ('brevet', submit_brevet, 4),
+    ('brevet', view_db, 4),
+    ('api', api_list_json, 12),
+    ('api', api_list_csv, 8),
+    ('api', api_login, 2),
+    ('ui', ui_list_json, 12),
+    ('ui', ui_list_csv, 8),
+    ('ui', ui_login, 2),
+]
+
+
+#########
+# Runner
+#########
+
+class Session:
+    """One simulated user: a client per service plus its latency samples."""
+
+    def __init__(self, clients, rider):
+        self.clients = clients
+        self.credentials = {'username': 'rider{:05d}'.format(rider),
+                            'password': 'password{}'.format(rider)}
+        self.samples = {}   # route label -> list of seconds
+        self.errors = {}    # route label -> count
+
+    def timed(self, service, label, method, path, data=None):
+        started = time.perf_counter()
+        status, body = self.clients[service].request(method, path, data)
+        elapsed = time.perf_counter() - started
+        self.samples.setdefault(label, []).append(elapsed)
+        if status >= 400:
+            self.errors[label] = self.errors.get(label, 0) + 1
+        return body
+
+    def ui_form(self, get_label, post_label, path):
+        page = self.timed('ui', get_label, 'GET', path)
+        form = dict(self.credentials)
+        match = CSRF_TOKEN.search(page)
+        if match:
+            form['csrf_token'] = match.group(1)
+        self.timed('ui', post_label, 'POST', path, form)
+
+    def setup(self):
+        """Register and log in on every service under test."""
+        if 'api' in self.clients:
+            self.timed('api', 'POST /api/register', 'POST', '/api/register', self.credentials)
+            api_login(self)
+        if 'ui' in self.clients:
+            self.ui_form('GET /register', 'POST /register', '/register')
+            ui_login(self)
+        if 'brevet' in self.clients:
+            submit_brevet(self)
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def summarize(sessions, elapsed):
+    samples, errors = {}, {}
+    for session in sessions:
+        for label, values in session.samples.items():
+            samples.setdefault(label, []).extend(values)
+        for label, count in session.errors.items():
+            errors[label] = errors.get(label, 0) + count
+
+    routes = {}
+    for label in sorted(samples):
+        ordered = sorted(samples[label])
+        routes[label] = {
+            'count': len(ordered),
+            'errors': errors.get(label, 0),
+            'rps': round(len(ordered) / elapsed, 2),
+            'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+            'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+            'p99_ms': round(percentile(ordered, 99) * 1000, 3)
+        }
+    total = sum(route['count'] for route in routes.values())
+    return {
+        'requests': total,
+        'errors': sum(errors.values()),
+        'rps': round(total / elapsed, 2),
+        'routes': routes
+    }
+
+
+def run(make_clients, names, workers, duration, requests_per_worker):
+    traffic = [t for t in TRAFFIC if t[0] in names]
+    scenarios = [t[1] for t in traffic]
+    weights = [t[2] for t in traffic]
+    sessions = [Session(make_clients(), i) for i in range(workers)]
+    for session in sessions:
+        session.setup()
+    for session in sessions:   # Measure steady state only
+        session.samples.clear()
+        session.errors.clear()
+
+    deadline = time.perf_counter() + duration
+
+    def drive(session):
+        done = 0
+        while time.perf_counter() < deadline:
+            if requests_per_worker and done >= requests_per_worker:
+                break
+            random.choices(scenarios, weights)[0](session)
+            done += 1
+
+    threads = [threading.Thread(target=drive, args=(s,)) for s in sessions]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(sessions, time.perf_counter() - started)
+
+
+################
+# Service setup
+################
+
+def bench_workdir():
+    """A temporary working directory holding BENCH_INI as app.ini."""
+    workdir = tempfile.mkdtemp(prefix='brevet-loadtest-')
+    with open(os.path.join(workdir, 'app.ini'), 'w') as ini:
+        ini.write(BENCH_INI)
+    return workdir
+
+
+def load_inprocess(names, mongo_url):
+    """Import the selected apps, all sharing one Mongo client."""
+    sys.path.insert(0, ROOT)   # brevetlib
+    from brevetlib import store
+    if mongo_url:
+        import pymongo
+        shared = pymongo.MongoClient(mongo_url)
+    else:
+        import mongomock
+        shared = mongomock.MongoClient()
+    # Every service reaches Mongo through brevetlib's process-wide client
+    store._client = shared
+
+    saved_argv, saved_cwd = sys.argv, os.getcwd()
+    workdir = bench_workdir()
+    apps = {}
+    try:
+        sys.argv = [sys.argv[0]]
+        os.chdir(workdir)
+        for name in names:
+            directory, module, _ = SERVICES[name]
+            sys.path.insert(0, os.path.join(ROOT, directory))
+            apps[name] = __import__(module).app
+    finally:
+        sys.argv = saved_argv
+        os.chdir(saved_cwd)
+    return apps
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('Service on port {} did not start'.format(port))
+
+
+def start_gunicorn(names, mongo_url, gunicorn_workers):
+    workdir = bench_workdir()
+    procs = {}
+    for name in names:
+        directory, module, port = SERVICES[name]
+        # Run from workdir (for app.ini); import from the service's directory
+        env = dict(os.environ, MONGO_URI=mongo_url,
+                   PYTHONPATH=os.pathsep.join([os.path.join(ROOT, directory), ROOT,
+                                               os.environ.get('PYTHONPATH', '')]))
+        procs[name] = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn',
+             '--chdir', workdir,
+             '-w', str(gunicorn_workers),
+             '-b', '127.0.0.1:{}'.format(port),
+             '{}:app'.format(module)],
+            env=env)
+    for name in names:
+        wait_for_port(SERVICES[name][2])
+    return procs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Brevet services load test")
+    parser.add_argument('--mode', choices=['inprocess', 'gunicorn'], default='inprocess')
+    parser.add_argument('--services', default='brevet,api,ui',
+                        help="Comma separated subset of: brevet, api, ui")
+    parser.add_argument('--mongo', help="mongod URL (default: mongomock, inprocess only)")
+    parser.add_argument('--workers', type=int, default=4, help="Concurrent simulated users")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run")
+    parser.add_argument('--requests', type=int, default=0,
+                        help="Stop each user after this many requests (0 = no limit)")
+    parser.add_argument('--gunicorn-workers', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=322)
+    parser.add_argument('-o', '--output', help="Write the JSON report here as well")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    names = [name.strip() for name in args.services.split(',') if name.strip()]
+    procs = {}
+    if args.mode == 'inprocess':
+        apps = load_inprocess(names, args.mongo)
+
+        def make_clients():
+            return {name: InProcessClient(app) for name, app in apps.items()}
+    else:
+        if not args.mongo:
+            parser.error('--mode gunicorn needs --mongo')
+        procs = start_gunicorn(names, args.mongo, args.gunicorn_workers)
+
+        def make_clients():
+            return {name: HttpClient('http://127.0.0.1:{}'.format(SERVICES[name][2]))
+                    for name in names}
+
+    try:
+        report = run(make_clients, names, args.workers, args.duration, args.requests)
+    finally:
+        for proc in procs.values():
+            proc.terminate()
+            proc.wait()
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                         cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    report.update({
+        'commit': commit,
+        'mode': args.mode,
+        'services': names,
+        'workers': args.workers,
+        'duration_s': args.duration
+    })
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Import-time budget for the service entry points.
+
+Each entry point is imported in a fresh interpreter under
+`python -X importtime`, with MONGO_URI pointing at a port nothing
+listens on, so anything that talks to Mongo or does real work at import
+shows up as a blown budget.  IMPORT_BUDGET_MS overrides the budget,
+which is about twice what the entry points take today.  Modules only
+some requests need must also still be unloaded after the import.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+from loadtest import ROOT, BENCH_INI
+
+IMPORT_BUDGET_MS = int(os.environ.get('IMPORT_BUDGET_MS', 800))
+
+# Loaded on first use by every service
+LAZY_MODULES = ('passlib', 'brevetlib.passwords')
+
+# (service directory, entry module, further modules it loads on first use)
+ENTRY_POINTS = [
+	('brevet', 'flask_app', ('brevetlib.notify', 'brevetlib.intervals', 'brevetlib.aio')),
+	('brevet_api', 'api', ('arrow', 'bulk_users', 'brevetlib.aio', 'brevetlib.writebehind')),
+	('brevet_api', 'api_async', ('brevetlib.writebehind', 'brevetlib.pages')),
+	('brevet_ui', 'auth_ui', ('brevetlib.aio', 'brevetlib.writebehind', 'brevetlib.model')),
+]
+
+
+def import_module(directory, module):
+	'''
+	Imports module in a fresh interpreter; returns its cumulative import
+	time in milliseconds, as -X importtime reports it, and the set of
+	modules loaded
+	'''
+	workdir = tempfile.mkdtemp()
+	with open(os.path.join(workdir, 'app.ini'), 'w') as ini:
+		ini.write(BENCH_INI)
+	env = dict(os.environ,
+		PYTHONPATH=os.pathsep.join([os.path.join(ROOT, directory), ROOT]),
+		MONGO_URI='mongodb://127.0.0.1:9/?serverSelectionTimeoutMS=5000',
+		JINJA_CACHE_DIR=os.path.join(workdir, 'jinja'))
+	code = 'import sys, {}; print(" ".join(sys.modules))'.format(module)
+	done = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=workdir, env=env,
+		stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=60)
+	assert done.returncode == 0, done.stderr[-2000:]
+	for line in reversed(done.stderr.splitlines()):
+		fields = line.split('|')
+		if line.startswith('import time:') and fields[-1].strip() == module:
+			return int(fields[1]) / 1000, set(done.stdout.split())
+	raise AssertionError('No import time for {}'.format(module))
+
+
+def test_entry_points_import_within_budget():
+	''' Every service imports within IMPORT_BUDGET_MS, without touching Mongo or loading lazy modules '''
+	over, eager = {}, {}
+	for directory, module, lazy in ENTRY_POINTS:
+		ms, loaded = import_module(directory, module)
+		if ms > IMPORT_BUDGET_MS:
+			over[module] = ms
+		loaded_early = loaded.intersection(LAZY_MODULES + lazy)
+		if loaded_early:
+			eager[module] = sorted(loaded_early)
+	assert not over, 'Over the {}ms import budget: {}'.format(IMPORT_BUDGET_MS, over)
+	assert not eager, 'Loaded at import: {}'.format(eager)
@@ -0,0 +1,300 @@
+"""
+Offline batch computation of brevet schedules.
+
+Reads routes (a brevet distance, one or more start times and a list of
+controls) from CSV or JSON, computes every control's open and close
+time for every start with acp_times, and writes one row per
+(route, start, control) as CSV, JSON or Parquet.  Work is split into
+chunks and spread over a process pool; input is read and output written
+as the chunks stream through, so whole seasons fit in memory.
+
+USE: python -m acp_times routes.csv -o schedule.csv --workers 8
+
+Input formats:
+  CSV    columns route_id, brevet_dist_km, start, control_km[, location];
+         consecutive rows with the same route_id and start form one route
+  JSON   a list of routes, or JSON Lines (.jsonl) with one route per line:
+         {"id": ..., "brevet_dist_km": 300,
+          "starts": ["2018-06-01T06:00", ...]   (or "start": "..."),
+          "controls": [{"km": 0, "location": "Start"}, ...]}
+
+A route with a distance other than 200, 300, 400, 600 or 1000km, an
+unreadable start or a bad control_km is skipped and reported on stderr.
+Output files are written under a temporary name and only appear once
+the whole run has succeeded.
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import arrow
+from acp_times import control_times, BREVET_DISTANCES
+
+OUTPUT_FIELDS = ('route_id', 'start', 'control_km', 'location', 'open', 'close')
+DEFAULT_CHUNK = 256   # (route, start) jobs per task sent to a worker
+
+
+#########
+# Input
+#   Every reader yields jobs: (route_id, brevet_dist_km, start, controls)
+#   where start is an arrow time and controls a list of (km, location).
+#   A route that cannot be computed is not yielded: it is appended to
+#   skipped as (where in the input, reason) and the rest carry on.
+#########
+
+def make_job(route_id, dist, start, controls):
+    """
+    A validated job from raw values, controls as (km, location) pairs;
+    raises ValueError naming what is wrong.
+    """
+    try:
+        dist = int(dist)
+    except (TypeError, ValueError):
+        dist = None
+    if dist not in BREVET_DISTANCES:
+        raise ValueError('brevet_dist_km must be one of {}'.format(
+            ', '.join(str(d) for d in BREVET_DISTANCES)))
+    try:
+        start = arrow.get(start)
+    except (TypeError, ValueError, arrow.parser.ParserError):
+        raise ValueError('invalid start {!r}'.format(start))
+    checked = []
+    for raw, location in controls:
+        try:
+            km = float(raw)
+        except (TypeError, ValueError):
+            km = -1
+        if not math.isfinite(km) or km < 0:
+            raise ValueError('invalid control_km {!r}'.format(raw))
+        checked.append((km, location or ''))
+    return (route_id, dist, start, checked)
+
+
+def read_csv_jobs(stream, skipped):
+    rows = csv.DictReader(stream)
+    missing = {'route_id', 'brevet_dist_km', 'start', 'control_km'} - set(rows.fieldnames or ())
+    if missing:
+        raise ValueError('CSV input has no {} column'.format(', '.join(sorted(missing))))
+    numbered = ((rows.line_num, row) for row in rows)
+    key = lambda item: (item[1]['route_id'], item[1]['brevet_dist_km'], item[1]['start'])
+    for (route_id, dist, start), group in itertools.groupby(numbered, key):
+        group = list(group)
+        where = 'line {}'.format(group[0][0])
+        controls = [(row['control_km'], row.get('location')) for _, row in group]
+        try:
+            yield make_job(route_id, dist, start, controls)
+        except ValueError as err:
+            skipped.append((where, str(err)))
+
+
+def route_jobs(route, where, skipped):
+    try:
+        starts = route.get('starts') or [route['start']]
+        controls = [(ctrl['km'], ctrl.get('location')) for ctrl in route['controls']]
+        jobs = [make_job(route.get('id'), route['brevet_dist_km'], start, controls)
+                for start in starts]
+    except (KeyError, TypeError, AttributeError) as err:
+        skipped.append((where, 'malformed route ({!r})'.format(err)))
+        return []
+    except ValueError as err:
+        skipped.append((where, str(err)))
+        return []
+    return jobs
+
+
+def read_json_jobs(stream, skipped, lines=False):
+    if not lines:
+        for number, route in enumerate(json.load(stream), start=1):
+            yield from route_jobs(route, 'route {}'.format(number), skipped)
+        return
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        where = 'line {}'.format(number)
+        try:
+            route = json.loads(line)
+        except ValueError:
+            skipped.append((where, 'invalid JSON'))
+            continue
+        yield from route_jobs(route, where, skipped)
+
+
+def read_jobs(stream, input_format, skipped):
+    if input_format == 'csv':
+        return read_csv_jobs(stream, skipped)
+    return read_json_jobs(stream, skipped, lines=(input_format == 'jsonl'))
+
+
+#########
+# Work
+#########
+
+def compute_chunk(jobs):
+    """Runs in a worker: returns the output rows for a list of jobs."""
+    rows = []
+    for route_id, dist, start_time, controls in jobs:
+        times = control_times([km for km, _ in controls], dist, start_time)
+        for (km, location), (opens, closes) in zip(controls, times):
+            rows.append((route_id, start_time.isoformat(), km, location,
+                         opens.isoformat(), closes.isoformat()))
+    return rows
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def compute(jobs, workers, chunk_size=DEFAULT_CHUNK):
+    """Yields lists of output rows, in input order."""
+    chunks = chunked(jobs, chunk_size)
+    if workers <= 1:
+        yield from map(compute_chunk, chunks)
+        return
+    from multiprocessing import Pool
+    with Pool(workers) as pool:
+        yield from pool.imap(compute_chunk, chunks)
+
+
+#########
+# Output
+#########
+
+class CsvWriter:
+    def __init__(self, stream):
+        self.writer = csv.writer(stream)
+        self.writer.writerow(OUTPUT_FIELDS)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        pass
+
+
+class JsonWriter:
+    """Writes a JSON list of row objects without holding it in memory."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.first = True
+        stream.write('[')
+
+    def write(self, rows):
+        for row in rows:
+            self.stream.write('\n' if self.first else ',\n')
+            self.stream.write(json.dumps(dict(zip(OUTPUT_FIELDS, row))))
+            self.first = False
+
+    def close(self):
+        self.stream.write('\n]\n')
+
+
+class ParquetWriter:
+    """Writes one Parquet row group per chunk.  Needs pyarrow."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            sys.exit('Parquet output needs pyarrow (pip install pyarrow)')
+        self.pa = pyarrow
+        self.schema = pyarrow.schema([
+            ('route_id', pyarrow.string()), ('start', pyarrow.string()),
+            ('control_km', pyarrow.float64()), ('location', pyarrow.string()),
+            ('open', pyarrow.string()), ('close', pyarrow.string())
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        columns = [list(column) for column in zip(*rows)] if rows else [[]] * len(OUTPUT_FIELDS)
+        columns[0] = [None if value is None else str(value) for value in columns[0]]
+        self.writer.write_table(self.pa.Table.from_arrays(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def guess_format(path, default):
+    ext = os.path.splitext(path or '')[1].lstrip('.').lower()
+    return ext if ext in ('csv', 'json', 'jsonl', 'parquet') else default
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m acp_times',
+                                     description="Batch ACP brevet schedule computation")
+    parser.add_argument('input', help="Routes file (CSV, JSON or JSON Lines); - for stdin")
+    parser.add_argument('-o', '--output', default='-', help="Output file; - for stdout")
+    parser.add_argument('--input-format', choices=['csv', 'json', 'jsonl'])
+    parser.add_argument('--output-format', choices=['csv', 'json', 'parquet'])
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK,
+                        help="Starts computed per worker task")
+    args = parser.parse_args(argv)
+
+    input_format = args.input_format or guess_format(args.input, 'csv')
+    output_format = args.output_format or guess_format(args.output, 'csv')
+    if output_format == 'parquet' and args.output == '-':
+        parser.error('Parquet output needs a file (-o)')
+
+    # Output goes to a temporary file next to the real one, renamed into
+    # place only once every route is done
+    partial = None
+    if args.output != '-':
+        fd, partial = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(args.output)),
+                                       prefix='.' + os.path.basename(args.output) + '.')
+        os.close(fd)
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(partial, 0o666 & ~umask)   # as open() would have made it
+
+    started = time.perf_counter()
+    controls = 0
+    skipped = []
+    source = sink = None
+    done = False
+    try:
+        source = sys.stdin if args.input == '-' else open(args.input, newline='')
+        if output_format == 'parquet':
+            writer = ParquetWriter(partial)
+        else:
+            sink = sys.stdout if partial is None else open(partial, 'w', newline='')
+            writer = CsvWriter(sink) if output_format == 'csv' else JsonWriter(sink)
+        jobs = read_jobs(source, input_format, skipped)
+        for rows in compute(jobs, args.workers, args.chunk_size):
+            writer.write(rows)
+            controls += len(rows)
+        writer.close()
+        done = True
+    except ValueError as err:
+        # The input as a whole cannot be read (bad JSON, missing columns)
+        error = err
+    finally:
+        if source not in (None, sys.stdin):
+            source.close()
+        if sink not in (None, sys.stdout):
+            sink.close()
+        if partial is not None:
+            if done:
+                os.replace(partial, args.output)
+            else:
+                os.remove(partial)
+    if not done:
+        parser.error('cannot read {}: {}'.format(args.input, error))
+
+    for where, reason in skipped:
+        print('skipped {} ({}): {}'.format(where, args.input, reason), file=sys.stderr)
+    elapsed = time.perf_counter() - started
+    print('{} control times in {:.2f}s ({:.0f}/s, {} workers, {} routes skipped)'.format(
+        controls, elapsed, controls / elapsed if elapsed else 0, args.workers, len(skipped)),
+        file=sys.stderr)
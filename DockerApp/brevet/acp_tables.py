@@ -0,0 +1,122 @@
+"""
+Persistent, memory-mapped open/close offset tables.
+
+The tables behind acp_times.offset_table (the open and close offset, in
+minutes, at every whole km of every brevet distance) are written once
+to a small binary file -- at image build time, see the Dockerfile --
+and mapped read-only by every process that needs them.  Lookups read
+the mapped pages through memoryviews, so gunicorn workers share one
+copy in the page cache and nothing is recomputed at startup.
+
+File layout (little-endian):
+   header   4s magic 'ACPT', H format version, H number of distances
+   index    per distance: H brevet_dist_km, I byte offset of its data
+   data     per distance: (dist + 1) H open offsets, then (dist + 1) H
+            close offsets
+
+USE: python acp_tables.py [path]     (writes the file)
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from acp_times import open_offset, close_offset, BREVET_DISTANCES
+
+MAGIC = b'ACPT'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHH')
+ENTRY = struct.Struct('<HI')
+TABLE_PATH = os.environ.get('ACP_TABLE_PATH',
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'acp_offsets.bin'))
+
+_shared = None   # (tables or None,) once TABLE_PATH has been tried
+
+
+def build_tables(distances=BREVET_DISTANCES):
+    """Returns {brevet_dist_km: (opens, closes)} as arrays of unsigned shorts."""
+    tables = {}
+    for dist in distances:
+        kms = range(dist + 1)
+        tables[dist] = (array('H', (open_offset(km, dist) for km in kms)),
+                        array('H', (close_offset(km, dist) for km in kms)))
+    return tables
+
+
+def write_tables(path=TABLE_PATH, distances=BREVET_DISTANCES):
+    """Writes the table file; replaces any existing file atomically."""
+    tables = build_tables(distances)
+    offset = HEADER.size + ENTRY.size * len(tables)
+    index, data = [], []
+    for dist, (opens, closes) in tables.items():
+        index.append(ENTRY.pack(dist, offset))
+        for column in (opens, closes):
+            if sys.byteorder != 'little':
+                column = array('H', column)
+                column.byteswap()
+            data.append(column.tobytes())
+            offset += len(column) * column.itemsize
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(tables)))
+        out.writelines(index)
+        out.writelines(data)
+    os.replace(tmp, path)
+    return path
+
+
+def load_tables(path=TABLE_PATH):
+    """
+    Maps the table file and returns {brevet_dist_km: (opens, closes)},
+    each a read-only memoryview of unsigned shorts into the mapping
+    (no copy).  Returns None if the file is missing, from another
+    format version, unreadable on this machine (big-endian), or does
+    not agree with acp_times -- callers then compute the tables.
+    """
+    if sys.byteorder != 'little':
+        return None
+    try:
+        with open(path, 'rb') as table_file:
+            mapped = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    view = memoryview(mapped)
+    try:
+        magic, version, count = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            return None
+        tables = {}
+        for i in range(count):
+            dist, offset = ENTRY.unpack_from(view, HEADER.size + i * ENTRY.size)
+            size = (dist + 1) * 2
+            opens = view[offset:offset + size].cast('H')
+            closes = view[offset + size:offset + 2 * size].cast('H')
+            tables[dist] = (opens, closes)
+    except (struct.error, TypeError, ValueError):
+        return None
+    if not _agrees(tables):
+        return None
+    return tables
+
+
+def _agrees(tables):
+    """Spot check a loaded file against the rules in acp_times."""
+    for dist, (opens, closes) in tables.items():
+        if len(opens) != dist + 1 or len(closes) != dist + 1:
+            return False
+        for km in (0, 1, dist // 2, dist):
+            if opens[km] != open_offset(km, dist) or closes[km] != close_offset(km, dist):
+                return False
+    return True
+
+
+def shared_tables():
+    """The tables from TABLE_PATH, mapped once per process (or None)."""
+    global _shared
+    if _shared is None:
+        _shared = (load_tables(),)
+    return _shared[0]
+
+
+if __name__ == '__main__':
+    print('Wrote {}'.format(write_tables(*sys.argv[1:2])))
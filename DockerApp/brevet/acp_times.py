@@ -3,9 +3,18 @@ Open and close time calculations
 for ACP-sanctioned brevets
 following rules described at https://rusa.org/octime_alg.html
 and https://rusa.org/pages/rulesForRiders
+
+Run as `python -m acp_times` to compute whole schedules offline
+(see acp_batch.py).
 """
 import arrow
 import math
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+from functools import lru_cache
+
+# The only official ACP brevet distances (km)
+BREVET_DISTANCES = (200, 300, 400, 600, 1000)
 
 #####
 # For ease of use, all time to be added will be represented in minutes as an int.
@@ -30,18 +39,15 @@ def better_round(num):
 
 
 # Governed by MAX SPEED
-def open_time(control_dist_km, brevet_dist_km, brevet_start_time):
+def open_offset(control_dist_km, brevet_dist_km):
     """
     Args:
        control_dist_km:  number, the control distance in kilometers
        brevet_dist_km: number, the nominal distance of the brevet
            in kilometers, which must be one of 200, 300, 400, 600,
            or 1000 (the only official ACP brevet distances)
-       brevet_start_time:  An ISO 8601 format date-time string indicating
-           the official start time of the brevet
     Returns:
-       An ISO 8601 format date string indicating the control open time.
-       This will be in the same time zone as the brevet start time.
+       int, minutes from the brevet start until the control opens.
     """
     # list of tuples: (dist_lower_bound, max_speed) --> UNITS: (km, km/hr)
     # descending order for ease of iteration
@@ -50,7 +56,7 @@ def open_time(control_dist_km, brevet_dist_km, brevet_start_time):
     dist = 0      # keep track of remaining distance
 
     if (control_dist_km == 0):
-      return brevet_start_time
+      return 0
     else:
       if(control_dist_km > brevet_dist_km):
         dist = brevet_dist_km     # if greater, use theoretical distance (which is an int)
@@ -65,22 +71,37 @@ def open_time(control_dist_km, brevet_dist_km, brevet_start_time):
           mins = (margin/bound[1])*60
           add_time += better_round(mins)
 
-      return brevet_start_time.shift(minutes=add_time)
+      return add_time
+
+
+def open_time(control_dist_km, brevet_dist_km, brevet_start_time):
+    """
+    Args:
+       control_dist_km:  number, the control distance in kilometers
+       brevet_dist_km: number, the nominal distance of the brevet
+           in kilometers, which must be one of 200, 300, 400, 600,
+           or 1000 (the only official ACP brevet distances)
+       brevet_start_time:  An ISO 8601 format date-time string indicating
+           the official start time of the brevet
+    Returns:
+       An ISO 8601 format date string indicating the control open time.
+       This will be in the same time zone as the brevet start time.
+    """
+    if (control_dist_km == 0):
+      return brevet_start_time
+    return brevet_start_time.shift(minutes=open_offset(control_dist_km, brevet_dist_km))
 
 
 # Governed by MIN SPEED
-def close_time(control_dist_km, brevet_dist_km, brevet_start_time):
+def close_offset(control_dist_km, brevet_dist_km):
     """
     Args:
       control_dist_km: number, the control distance in kilometers
       brevet_dist_km: number, the nominal distance of the brevet
           in kilometers, which must be one of 200, 300, 400, 600, or 1000
           (the only official ACP brevet distances)
-      brevet_start_time:  An ISO 8601 format date-time string indicating
-           the official start time of the brevet
     Returns:
-       An ISO 8601 format date string indicating the control close time.
-       This will be in the same time zone as the brevet start time.
+       int, minutes from the brevet start until the control closes.
     """
     # dict of time limits --> brevet_dist_km : time_limit_to_complete ---- UNITS: (km, minutes)
     brev_time_limit = {200:810, 300:1200, 400:1620, 600:2400, 1000:4500} 
@@ -91,11 +112,10 @@ def close_time(control_dist_km, brevet_dist_km, brevet_start_time):
 
     if (control_dist_km == 0):
       # Close time of starting point is 1 hr after start time
-      return brevet_start_time.shift(minutes=60)   
+      return 60
     elif (control_dist_km >= brevet_dist_km):
-      # Look up time limit in dict and return start time + time limit
-      add_time = brev_time_limit[brevet_dist_km]
-      return brevet_start_time.shift(minutes=add_time)
+      # Look up time limit in dict
+      return brev_time_limit[brevet_dist_km]
     else:
       dist = better_round(control_dist_km)    # otherwise, use control dist rounded to nearest km
 
@@ -107,8 +127,116 @@ def close_time(control_dist_km, brevet_dist_km, brevet_start_time):
           mins = (margin/bound[1])*60
           add_time += better_round(mins)
 
-      return brevet_start_time.shift(minutes=add_time)
+      return add_time
+
 
+def close_time(control_dist_km, brevet_dist_km, brevet_start_time):
+    """
+    Args:
+      control_dist_km: number, the control distance in kilometers
+      brevet_dist_km: number, the nominal distance of the brevet
+          in kilometers, which must be one of 200, 300, 400, 600, or 1000
+          (the only official ACP brevet distances)
+      brevet_start_time:  An ISO 8601 format date-time string indicating
+           the official start time of the brevet
+    Returns:
+       An ISO 8601 format date string indicating the control close time.
+       This will be in the same time zone as the brevet start time.
+    """
+    return brevet_start_time.shift(minutes=close_offset(control_dist_km, brevet_dist_km))
+
+
+def control_times(control_dists_km, brevet_dist_km, brevet_start_time):
+    """
+    Args:
+       control_dists_km: iterable of numbers, the control distances in
+           kilometers of one brevet
+       brevet_dist_km: number, the nominal distance of the brevet
+       brevet_start_time: arrow object, the official start time
+    Returns:
+       A list of (open, close) arrow pairs, one per control, in the
+       order given.  Lets a whole brevet be computed in one call
+       (e.g. when it is submitted) instead of one request per control.
+    """
+    return [(open_time(km, brevet_dist_km, brevet_start_time),
+             close_time(km, brevet_dist_km, brevet_start_time))
+            for km in control_dists_km]
+
+
+def wave_schedule(control_dists_km, brevet_dist_km, start_times):
+    """
+    Args:
+       control_dists_km: iterable of numbers, the control distances in
+           kilometers of one brevet
+       brevet_dist_km: number, the nominal distance of the brevet
+       start_times: list of arrow objects, one per start wave
+    Returns:
+       (opens, closes): two control-by-wave matrices (lists of lists)
+       of arrow objects, e.g. opens[c][w] is when control c opens for
+       wave w.  Each control's offsets are computed once and added to
+       every start, rather than recomputing the control per wave.
+    """
+    opens, closes = [], []
+    for km in control_dists_km:
+        open_delta = timedelta(minutes=open_offset(km, brevet_dist_km))
+        close_delta = timedelta(minutes=close_offset(km, brevet_dist_km))
+        opens.append([start + open_delta for start in start_times])
+        closes.append([start + close_delta for start in start_times])
+    return opens, closes
+
+
+@lru_cache(maxsize=None)
+def offset_table(brevet_dist_km):
+    """
+    Args:
+       brevet_dist_km: number, the nominal distance of the brevet
+    Returns:
+       (opens, closes): sequences indexed by whole km from 0 to
+       brevet_dist_km of the open and close offsets in minutes.
+       Controls are rounded to the nearest km, so these breakpoints
+       describe the open/close functions completely.  Read from the
+       memory-mapped file written by acp_tables.py when there is one
+       (shared by all worker processes), else computed once per
+       brevet distance.
+    """
+    import acp_tables   # Imports this module; only needed here
+    mapped = acp_tables.shared_tables()
+    if mapped and brevet_dist_km in mapped:
+        return mapped[brevet_dist_km]
+    kms = range(brevet_dist_km + 1)
+    return (tuple(open_offset(km, brevet_dist_km) for km in kms),
+            tuple(close_offset(km, brevet_dist_km) for km in kms))
+
+
+def distance_window(elapsed_minutes, brevet_dist_km):
+    """
+    The inverse of open_time/close_time.
+    Args:
+       elapsed_minutes: number, time since the brevet start
+       brevet_dist_km: number, the nominal distance of the brevet
+    Returns:
+       (min_km, max_km): the whole-km range where controls are open at
+       that time, i.e. where a rider must be to be within limits; or
+       None if there is none (before the start or after the time
+       limit).  Answered by binary search over offset_table().
+
+       The start control also stays open for the first hour (see
+       close_time); that is a rule for the start, not for where riders
+       must be, so it does not widen the window.
+    """
+    opens, closes = offset_table(brevet_dist_km)
+    # Both offsets never decrease with distance (leaving aside the
+    # start's hour): the farthest open and the nearest unclosed control.
+    max_km = bisect_right(opens, elapsed_minutes) - 1
+    if elapsed_minutes <= 0:
+        min_km = 0
+    else:
+        min_km = bisect_left(closes, elapsed_minutes, 1)
+    if max_km < 0 or min_km > max_km:
+        return None
+    return (min_km, max_km)
 
-      
 
+if __name__ == "__main__":
+    from acp_batch import main
+    main()
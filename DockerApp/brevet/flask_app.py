@@ -2,22 +2,41 @@
 # Author: Andrew Werderman
 
 import os
+import math
 import flask
 from flask import Flask, redirect, url_for, request, render_template
-from pymongo import MongoClient
-from acp_times import open_time, close_time  # Brevet time calculations
+from acp_times import (  # Brevet time calculations
+    open_time, close_time, wave_schedule, open_offset, close_offset,
+    distance_window, BREVET_DISTANCES)
 
 import arrow  # Replacement for datetime, based on moment.js
+import csv
+import io
 import config
 import logging
+import brevetlib  # Shared brevet/user data access
+from brevetlib import Brevet
 
 app = Flask(__name__)
-CONFIG = config.configuration()
+CONFIG = config.configuration(proxied=(__name__ != '__main__'))
+brevetlib.configure_logging(
+    level=logging.DEBUG if CONFIG.DEBUG else logging.INFO,
+    sampling=getattr(CONFIG, 'LOG_SAMPLING', None))
 app.secret_key = CONFIG.SECRET_KEY
+brevetlib.defer_schema(app)  # Indexes and migrations, on the first request
+brevetlib.cache_templates(app)  # Compiled templates kept across processes
+assets = brevetlib.AssetManifest(app)  # Fingerprinted static files, see asset_url()
 
-client = MongoClient('mongodb://mongo:27017/')
-db = client['brevetdb']
-collection = db['brevet']
+# Optional write-behind mode (app.ini: WRITE_BEHIND = True): submits are
+# acknowledged at once and written by a background thread in coalesced
+# batches; /_submission/<id> reports, from any worker, when each is durable.
+write_concern = brevetlib.parse_write_concern(getattr(CONFIG, 'WRITE_CONCERN', None))
+if getattr(CONFIG, 'WRITE_BEHIND', False):
+    writer = brevetlib.WriteBehindQueue(
+        max_pending=getattr(CONFIG, 'WRITE_BEHIND_QUEUE', 100),
+        write_concern=write_concern)
+else:
+    writer = None
 
 ###
 # Pages
@@ -27,22 +46,37 @@ collection = db['brevet']
 @app.route("/index")
 def index():
     app.logger.debug("Main page entry")
-    collection.delete_many({})
+    # Nothing to clear (the usual case) means no write and no submission
+    if brevetlib.has_controls():
+        try:
+            _store_brevet([])
+        except brevetlib.QueueFull:
+            # The writer is backed up; the page still works, the brevet is just not cleared
+            app.logger.warning("Write-behind queue full, brevet not cleared")
     return render_template('calc.html')
 
 
+# /db lists the brevet a page at a time; rendered pages are kept until
+# the brevet changes
+DB_PAGE_SIZE = getattr(CONFIG, 'DB_PAGE_SIZE', 50)
+db_pages = brevetlib.PageCache()
+
+
 @app.route('/db')
 def db():
-    _controls = collection.find()
-    controls = []
-    for ctrl in _controls:
-        controls.append({
-            'control_km': ctrl['control_km'],
-            'control_location': ctrl['control_location'],
-            'open_time': ctrl['open_time'],
-            'close_time': ctrl['close_time']
-        })
-    return render_template('db.html', items=controls)
+    try:
+        number = max(1, int(request.args.get('page', 1)))
+    except ValueError:
+        number = 1
+    brevet_id = brevetlib.store.DEFAULT_BREVET_ID
+    key = (brevet_id, brevetlib.brevet_version(brevet_id), number)
+    page = db_pages.get(key)
+    if page is None:
+        # Streamed as it renders (the controls are read as the template
+        # iterates over them), and cached once complete
+        controls = brevetlib.ControlPage(number, DB_PAGE_SIZE, brevet_id)
+        page = db_pages.caching(key, flask.stream_template('db.html', page=controls))
+    return flask.Response(page, mimetype='text/html')
 
 
 @app.errorhandler(404)
@@ -84,42 +118,216 @@ def _calc_times():
     return flask.jsonify(result=result)
 
 
+@app.route("/_calc_inverse")
+def _calc_inverse():
+    """
+    The reverse of /_calc_times: the range of control distances (km)
+    that are open at a given time, i.e. where a rider must be to be
+    within limits.  The time is given either as 'minutes' after the
+    start, or as at_date/at_time alongside start_date/start_time.
+    """
+    app.logger.debug("Got a JSON request")
+    brev_dist_km = request.args.get('brev_dist_km', 300, type=int)
+    minutes = request.args.get('minutes', None, type=float)
+    if brev_dist_km not in BREVET_DISTANCES:
+        return flask.jsonify(result={'Error': 'Invalid brevet distance'}), 400
+    if (minutes is not None) and not math.isfinite(minutes):   # 'nan', 'inf'
+        return flask.jsonify(result={'Error': 'Invalid time'}), 400
+
+    if minutes is None:
+        start_date = request.args.get('start_date', '2018-01-19', type=str)
+        start_time = request.args.get('start_time', '16:00', type=str)
+        at_date = request.args.get('at_date', start_date, type=str)
+        at_time = request.args.get('at_time', start_time, type=str)
+        try:
+            brev_start_time = arrow.get('{} {}'.format(start_date, start_time), 'YYYY-MM-DD HH:mm')
+            at = arrow.get('{} {}'.format(at_date, at_time), 'YYYY-MM-DD HH:mm')
+        except (arrow.parser.ParserError, ValueError):
+            return flask.jsonify(result={'Error': 'Invalid time'}), 400
+        minutes = (at - brev_start_time).total_seconds() / 60
+
+    window = distance_window(minutes, brev_dist_km)
+    if window is None:
+        result = {'minutes': minutes, 'min_km': None, 'max_km': None}
+    else:
+        result = {'minutes': minutes, 'min_km': window[0], 'max_km': window[1]}
+    return flask.jsonify(result=result)
+
+
+MAX_WAVES = 200   # Start waves per /_wave_times request
+
+
+@app.route("/_wave_times")
+def _wave_times():
+    """
+    Open/close times of a set of controls for several start waves.
+    Arguments:
+      km - a control distance; repeat for each control
+      brev_dist_km - the brevet distance
+      start - a wave's start time (ISO 8601); repeat for each wave
+        or start_date, start_time, waves and interval (minutes) to
+        generate evenly spaced waves
+      format - 'json' (default): control-by-wave matrices of ISO times
+               'csv': one line per control, an open and close column per wave
+               'columns': the control distances, the starts and each
+                 control's open/close offset in minutes, for clients
+                 that add them to the starts themselves
+    """
+    app.logger.debug("Got a JSON request")
+    resultFormat = request.args.get('format', 'json', type=str)
+    brev_dist_km = request.args.get('brev_dist_km', 300, type=int)
+    kms = [_control_km(km, brev_dist_km) for km in request.args.getlist('km')]
+
+    if (brev_dist_km not in BREVET_DISTANCES) or (None in kms) or (kms == []):
+        return flask.jsonify(result={'Error': 'Invalid brevet or control distance'}), 400
+    if resultFormat not in ('json', 'csv', 'columns'):
+        return flask.jsonify(result={'Error': 'Invalid format'}), 400
+    try:
+        starts = _wave_starts()
+    except (arrow.parser.ParserError, ValueError):
+        return flask.jsonify(result={'Error': 'Invalid start time'}), 400
+    if not (0 < len(starts) <= MAX_WAVES):
+        return flask.jsonify(result={'Error': 'Between 1 and {} waves'.format(MAX_WAVES)}), 400
+
+    if resultFormat == 'columns':
+        result = {
+            'control_km': kms,
+            'start': [start.isoformat() for start in starts],
+            'open_offset': [open_offset(km, brev_dist_km) for km in kms],
+            'close_offset': [close_offset(km, brev_dist_km) for km in kms]
+        }
+        return flask.jsonify(result=result)
+
+    opens, closes = wave_schedule(kms, brev_dist_km, starts)
+    if resultFormat == 'csv':
+        out = io.StringIO()
+        writer = csv.writer(out)
+        header = ['control_km']
+        for start in starts:
+            header += ['open ' + start.isoformat(), 'close ' + start.isoformat()]
+        writer.writerow(header)
+        for km, control_opens, control_closes in zip(kms, opens, closes):
+            row = [km]
+            for opens_at, closes_at in zip(control_opens, control_closes):
+                row += [opens_at.isoformat(), closes_at.isoformat()]
+            writer.writerow(row)
+        return flask.Response(out.getvalue(), mimetype='text/csv')
+
+    result = {
+        'control_km': kms,
+        'start': [start.isoformat() for start in starts],
+        'open': [[t.isoformat() for t in row] for row in opens],
+        'close': [[t.isoformat() for t in row] for row in closes]
+    }
+    return flask.jsonify(result=result)
+
+
+def _wave_starts():
+    """The start waves requested by /_wave_times, as arrow objects."""
+    starts = request.args.getlist('start')
+    if starts:
+        return [arrow.get(start) for start in starts]
+    start_date = request.args.get('start_date', '2018-01-19', type=str)
+    start_time = request.args.get('start_time', '16:00', type=str)
+    waves = request.args.get('waves', 1, type=int)
+    interval = request.args.get('interval', 15, type=int)
+    first = arrow.get('{} {}'.format(start_date, start_time), 'YYYY-MM-DD HH:mm')
+    return [first.shift(minutes=interval * wave) for wave in range(min(waves, MAX_WAVES + 1))]
+
+
 @app.route('/_submit_to_db', methods=['POST'])
 def _submit_to_db():
-    brevet = []
-    numItems = 0
-    collection.delete_many({}) # Clear out all current inputs
-
+    """
+    Stores the brevet on the form.  Only the control distances and
+    locations, the brevet distance and the start are taken from the
+    client; open and close times are computed here, in one batch, and
+    stored as dates.  Rows without a valid distance are skipped.
+    """
     # Collect brevet data from POST (return type: string)
+    brev_dist_km = request.form.get('distance', type=int)
+    start_date = request.form.get('begin_date', '', type=str)
+    start_time = request.form.get('begin_time', '', type=str)
     control_kms = request.form.getlist('km')
     control_locs = request.form.getlist('location')
-    open_times = request.form.getlist('open')
-    close_times = request.form.getlist('close')
-    
-    for i, item in enumerate(open_times):
-        # Invalid input handled on page, OPEN_TIME field will be empty string
-        if (item == ''):
+
+    if brev_dist_km not in BREVET_DISTANCES:
+        return flask.jsonify(result={'message': 'Invalid brevet distance', 'num': 0})
+    try:
+        brev_start_time = arrow.get('{} {}'.format(start_date, start_time), 'YYYY-MM-DD HH:mm')
+    except (arrow.parser.ParserError, ValueError):
+        return flask.jsonify(result={'message': 'Invalid start time', 'num': 0})
+
+    # Offsets from the start are all a brevet needs; the model keeps
+    # controls in control_km order
+    brevet = Brevet(brev_start_time.datetime, brev_dist_km)
+    for i, item in enumerate(control_kms):
+        km = _control_km(item, brev_dist_km)
+        # Empty or invalid distance (also flagged on the page)
+        if km is None:
             continue
-        control_doc = {
-            'control_km': int(control_kms[i]),
-            'control_location': control_locs[i],
-            'open_time': open_times[i],
-            'close_time': close_times[i]
-        }
-        brevet.append(control_doc)
-        numItems += 1
+        location = control_locs[i] if i < len(control_locs) else ''
+        brevet.add(km, location, open_offset(km, brev_dist_km), close_offset(km, brev_dist_km))
+
+    numItems = len(brevet)
+    try:
+        submission = _store_brevet(brevet.to_bson())
+    except brevetlib.QueueFull:
+        # Backpressure: too many submissions waiting to be written
+        return flask.jsonify(result={'message': 'Server busy, please resubmit', 'num': 0}), 503
 
-    if (brevet == []):
+    if numItems == 0:
         result = {'message': 'Empty Brevet', 'num': numItems}
     else: 
-        # Sort brevet and insert it into the db
-        brevet.sort(key=lambda ctrl: ctrl['control_km'])
-        collection.insert(brevet)
         result = {'message': 'A-OK', 'num': numItems}
+    if submission:
+        result['submission'] = submission
 
     return flask.jsonify(result=result)
 
 
+@app.route('/_submission/<submission>')
+def _submission_status(submission):
+    """
+    Whether a write-behind submission is 'pending', 'durable' (then
+    with the brevet version it produced), 'failed' or 'unknown'.
+    """
+    if writer is None:
+        return flask.jsonify(result={'status': 'unknown'}), 404
+    status, detail = writer.status(submission)
+    result = {'status': status}
+    if status == 'durable':
+        result['version'] = detail
+    elif status == 'failed':
+        result['error'] = detail
+    return flask.jsonify(result=result), (404 if status == 'unknown' else 200)
+
+
+def _store_brevet(controls):
+    """
+    Replace the stored brevet (an empty list clears it).  In write-behind
+    mode returns the submission id, otherwise writes now and returns None.
+    """
+    if writer is not None:
+        return writer.submit(controls)
+    brevetlib.replace_controls(controls, write_concern=write_concern)
+    return None
+
+
+def _control_km(value, brev_dist_km):
+    """
+    The control distance entered on the form as a number, or None if
+    it is empty, not a number, negative, or more than 15km past the
+    end of the brevet (the same rule the page applies).
+    """
+    try:
+        km = float(value)
+    except (TypeError, ValueError):
+        return None
+    if (km != km) or km < 0 or km > brev_dist_km + 15:   # km != km: NaN
+        return None
+    return km
+
+
 @app.route('/_display_db')
 def _display_db():
     result = url_for('db')
@@ -0,0 +1,76 @@
+"""
+Nose tests for acp_batch.py (python -m acp_times)
+"""
+import contextlib
+import io
+import json
+import os
+import tempfile
+from acp_batch import read_jobs, compute, main, JsonWriter
+
+ROUTES_CSV = '''route_id,brevet_dist_km,start,control_km,location
+r1,200,2018-06-01T06:00:00+00:00,0,Start
+r1,200,2018-06-01T06:00:00+00:00,175.3,Mid
+r1,200,2018-06-01T07:00:00+00:00,0,Start
+'''
+
+
+def test_csv_rows_grouped_by_route_and_start():
+	''' Consecutive rows sharing a route and start are one job '''
+	jobs = list(read_jobs(io.StringIO(ROUTES_CSV), 'csv', []))
+	assert [(job[0], job[2].isoformat(), len(job[3])) for job in jobs] == [
+		('r1', '2018-06-01T06:00:00+00:00', 2), ('r1', '2018-06-01T07:00:00+00:00', 1)]
+
+
+def test_json_route_expands_starts():
+	''' A JSON route with several starts gives one job per start '''
+	route = {'id': 'r2', 'brevet_dist_km': 300, 'starts': ['2018-06-01T06:00', '2018-06-01T06:30'],
+		'controls': [{'km': 0}, {'km': 250, 'location': 'Finish'}]}
+	jobs = list(read_jobs(io.StringIO(json.dumps([route])), 'json', []))
+	assert len(jobs) == 2 and jobs[1][3] == [(0.0, ''), (250.0, 'Finish')]
+
+
+def test_compute_in_chunks():
+	''' Chunking does not change the rows or their order; 175.3km opens at +5H09 '''
+	jobs = list(read_jobs(io.StringIO(ROUTES_CSV), 'csv', []))
+	whole = [row for rows in compute(jobs, workers=1, chunk_size=10) for row in rows]
+	chunked = [row for rows in compute(jobs, workers=1, chunk_size=1) for row in rows]
+	assert whole == chunked
+	assert whole[1][4] == '2018-06-01T11:09:00+00:00'
+
+
+def test_json_writer_output_is_valid_json():
+	out = io.StringIO()
+	writer = JsonWriter(out)
+	writer.write([('r1', 's', 0.0, 'Start', 'o', 'c')])
+	writer.close()
+	assert json.loads(out.getvalue())[0]['location'] == 'Start'
+
+
+def test_bad_routes_are_skipped():
+	''' A route with a non-ACP distance or a bad km is reported and skipped, not fatal '''
+	text = ROUTES_CSV + 'r2,250,2018-06-01T06:00:00+00:00,0,Start\nr3,200,2018-06-01T06:00:00+00:00,abc,Start\n'
+	skipped = []
+	jobs = list(read_jobs(io.StringIO(text), 'csv', skipped))
+	assert [job[0] for job in jobs] == ['r1', 'r1']
+	assert [where for where, _ in skipped] == ['line 5', 'line 6']
+	assert 'brevet_dist_km' in skipped[0][1] and 'control_km' in skipped[1][1]
+	routes = [{'id': 'a', 'brevet_dist_km': 200, 'start': 'soon', 'controls': []}, 'b', {'id': 'c'}]
+	skipped = []
+	assert list(read_jobs(io.StringIO(json.dumps(routes)), 'json', skipped)) == []
+	assert [where for where, _ in skipped] == ['route 1', 'route 2', 'route 3']
+
+
+def test_unreadable_input_leaves_no_output():
+	''' Input that cannot be read at all is an error, and no partial file is left '''
+	folder = tempfile.mkdtemp()
+	source = os.path.join(folder, 'routes.json')
+	with open(source, 'w') as routes:
+		routes.write('[{"id": "r1", ')
+	try:
+		with contextlib.redirect_stderr(io.StringIO()):
+			main([source, '-o', os.path.join(folder, 'out.json'), '-w', '1'])
+		assert False, 'accepted broken JSON'
+	except SystemExit as exit:
+		assert exit.code == 2
+	assert os.listdir(folder) == ['routes.json']
@@ -0,0 +1,26 @@
+"""
+Nose tests for acp_tables.py
+"""
+import os
+import tempfile
+from acp_tables import build_tables, write_tables, load_tables
+
+
+def test_round_trip():
+	''' The mapped file holds exactly the computed tables '''
+	with tempfile.TemporaryDirectory() as tmp:
+		path = write_tables(os.path.join(tmp, 'offsets.bin'))
+		loaded = load_tables(path)
+		for dist, (opens, closes) in build_tables().items():
+			assert list(loaded[dist][0]) == list(opens)
+			assert list(loaded[dist][1]) == list(closes)
+
+
+def test_bad_files_are_ignored():
+	''' Missing or foreign files give None, so callers compute the tables instead '''
+	with tempfile.TemporaryDirectory() as tmp:
+		path = os.path.join(tmp, 'offsets.bin')
+		assert load_tables(path) is None
+		with open(path, 'wb') as out:
+			out.write(b'not a table file')
+		assert load_tables(path) is None
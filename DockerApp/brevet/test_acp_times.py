@@ -4,7 +4,7 @@ Nose tests for acp_times.py
 Implemented by: Andrew Werderman
 """
 import nose 
-from acp_times import open_time, close_time
+from acp_times import open_time, close_time, control_times, wave_schedule, open_offset, close_offset, distance_window
 import arrow
 
 '''
@@ -224,3 +224,70 @@ def test_incorrect_close_calculation():
 
 
 
+
+################
+# control_times tests
+#	The batch used when a brevet is submitted must agree
+#	with open_time/close_time for every control.
+################
+
+def test_control_times_matches_single_calls():
+	''' One (open, close) pair per control, in the order given '''
+	kms = [0, 175.3, 550, 609]
+	times = control_times(kms, BREVET_DISTANCES[3], START_TIME)
+	assert times == [(open_time(km, BREVET_DISTANCES[3], START_TIME),
+		close_time(km, BREVET_DISTANCES[3], START_TIME)) for km in kms]
+
+
+################
+# wave_schedule tests
+#	Every wave gets the same offsets as a single start would.
+################
+
+def test_wave_schedule_matches_single_calls():
+	''' opens[c][w] and closes[c][w] agree with open_time/close_time for wave w '''
+	kms = [0, 175, 890, 1009]
+	starts = [START_TIME.shift(minutes=15 * wave) for wave in range(4)]
+	opens, closes = wave_schedule(kms, BREVET_DISTANCES[4], starts)
+	for c, km in enumerate(kms):
+		for w, start in enumerate(starts):
+			assert opens[c][w] == open_time(km, BREVET_DISTANCES[4], start)
+			assert closes[c][w] == close_time(km, BREVET_DISTANCES[4], start)
+
+
+################
+# distance_window tests
+#	The inverse must agree with the forward offsets at every
+#	whole km: a control is in the window exactly when it is open.
+################
+
+def test_distance_window_is_inverse():
+	for dist in BREVET_DISTANCES:
+		opens = [open_offset(km, dist) for km in range(dist + 1)]
+		closes = [close_offset(km, dist) for km in range(dist + 1)]
+		for minutes in range(-10, closes[dist] + 30, 7):
+			window = distance_window(minutes, dist)
+			for km in range(1, dist + 1):
+				is_open = opens[km] <= minutes <= closes[km]
+				in_window = window is not None and window[0] <= km <= window[1]
+				assert is_open == in_window, (dist, minutes, km)
+
+
+def test_distance_window_start_hour():
+	'''
+	The start stays open for an hour, but riders must have moved on:
+	only at the start time itself is km 0 in the window.
+	'''
+	assert distance_window(0, 200) == (0, 0)
+	assert distance_window(30, 200)[0] > 0
+
+
+def test_distance_window_examples():
+	''' 5H09 after the start of a 200, 175km is the farthest open control '''
+	assert distance_window(309, 200)[1] == 175
+
+
+def test_distance_window_at_limit():
+	''' At the 13H30 limit only the finish is still open; after it, nothing '''
+	assert distance_window(810, 200) == (200, 200)
+	assert distance_window(811, 200) is None
@@ -0,0 +1,123 @@
+"""
+Nose tests for flask_app.py through Flask's test client, run against
+mongomock
+"""
+import os
+import tempfile
+from datetime import datetime
+import arrow
+import mongomock
+import brevetlib
+from brevetlib import store
+from acp_times import open_time, close_time
+
+APP_INI = """[DEFAULT]
+SECRET_KEY = test
+DEBUG = False
+PORT = 5000
+"""
+
+flask_app = None
+
+
+def setup_module(module=None):
+	''' flask_app reads app.ini from the working directory when imported '''
+	global flask_app
+	saved = os.getcwd()
+	folder = tempfile.mkdtemp()
+	with open(os.path.join(folder, 'app.ini'), 'w') as ini:
+		ini.write(APP_INI)
+	os.chdir(folder)
+	try:
+		import flask_app
+	finally:
+		os.chdir(saved)
+
+
+def setup_function(function=None):
+	store._client = mongomock.MongoClient()
+	flask_app.db_pages = brevetlib.PageCache()   # Keyed by version, which restarts with Mongo
+
+
+def stored_times():
+	''' (control_km, open_time, close_time) as stored, times as UTC arrow '''
+	return [(doc['control_km'], arrow.get(doc['open_time']), arrow.get(doc['close_time']))
+		for doc in store.find_controls()]
+
+
+def get_json(path, **args):
+	response = flask_app.app.test_client().get(path, query_string=args)
+	return response.status_code, response.get_json()
+
+
+def test_calc_inverse_rejects_non_finite_minutes():
+	''' nan and inf are floats, but not times: 400, as for any bad time '''
+	for minutes in ('nan', 'inf', '-inf'):
+		assert get_json('/_calc_inverse', minutes=minutes, brev_dist_km=200) == (
+			400, {'result': {'Error': 'Invalid time'}})
+	status, reply = get_json('/_calc_inverse', minutes=309, brev_dist_km=200)
+	assert (status, reply['result']['max_km']) == (200, 175)
+
+
+def test_submit_stores_server_computed_times():
+	''' Times are computed on the server and stored as dates; rows with a bad km are skipped '''
+	form = {'distance': '200', 'begin_date': '2018-06-01', 'begin_time': '06:00',
+		'km': ['175.3', 'abc', '0', '', '-5'], 'location': ['Mid', 'Bad', 'Start', '', 'Neg'],
+		'open': 'ignored'}
+	response = flask_app.app.test_client().post('/_submit_to_db', data=form)
+	assert response.get_json() == {'result': {'message': 'A-OK', 'num': 2}}
+	start = arrow.get('2018-06-01 06:00', 'YYYY-MM-DD HH:mm')
+	assert stored_times() == [(km, open_time(km, 200, start), close_time(km, 200, start))
+		for km in (0.0, 175.3)]
+	docs = list(store.find_controls())
+	assert [doc['control_location'] for doc in docs] == ['Start', 'Mid']
+	assert all(isinstance(doc['open_time'], datetime) for doc in docs)
+
+
+def test_submit_rejects_bad_distance_or_start():
+	''' A non-ACP distance or an unreadable start stores nothing '''
+	client = flask_app.app.test_client()
+	form = {'distance': '250', 'begin_date': '2018-06-01', 'begin_time': '06:00', 'km': ['0']}
+	assert client.post('/_submit_to_db', data=form).get_json()['result']['message'] == 'Invalid brevet distance'
+	form.update(distance='200', begin_date='June 1st')
+	assert client.post('/_submit_to_db', data=form).get_json()['result']['message'] == 'Invalid start time'
+	assert stored_times() == []
+
+
+def test_wave_times():
+	''' Each wave is the first one shifted by the interval; a bad km is a 400 '''
+	status, reply = get_json('/_wave_times', km=['0', '100'], brev_dist_km=200,
+		start_date='2018-06-01', start_time='06:00', waves=2, interval=30)
+	assert status == 200
+	assert reply['result']['start'] == ['2018-06-01T06:00:00+00:00', '2018-06-01T06:30:00+00:00']
+	assert reply['result']['open'][1] == ['2018-06-01T08:56:00+00:00', '2018-06-01T09:26:00+00:00']
+	status, _ = get_json('/_wave_times', km=['0', 'far'], brev_dist_km=200)
+	assert status == 400
+
+
+def test_calc_inverse_from_clock_times():
+	''' at_date/at_time give the same window as the minutes they stand for '''
+	status, reply = get_json('/_calc_inverse', brev_dist_km=200, start_date='2018-06-01',
+		start_time='06:00', at_date='2018-06-01', at_time='11:09')
+	assert (status, reply) == get_json('/_calc_inverse', brev_dist_km=200, minutes=309)
+	assert get_json('/_calc_inverse', brev_dist_km=200, at_time='soon')[0] == 400
+
+
+def test_db_pages():
+	''' /db lists a page of controls at a time, and a new brevet replaces cached pages '''
+	client = flask_app.app.test_client()
+	saved = flask_app.DB_PAGE_SIZE
+	flask_app.DB_PAGE_SIZE = 2
+	try:
+		start = arrow.get('2018-06-01T06:00').datetime
+		store.replace_controls([{'control_km': km, 'control_location': 'c{}'.format(km),
+			'open_time': start, 'close_time': start} for km in (0, 50, 100)])
+		first = client.get('/db').get_data(as_text=True)
+		assert 'c0' in first and 'c50' in first and 'c100' not in first and 'Next' in first
+		second = client.get('/db?page=2').get_data(as_text=True)
+		assert 'c100' in second and 'Next' not in second and 'Previous' in second
+		store.replace_controls([{'control_km': 7, 'control_location': 'new',
+			'open_time': start, 'close_time': start}])
+		assert 'new' in client.get('/db').get_data(as_text=True)
+	finally:
+		flask_app.DB_PAGE_SIZE = saved
@@ -2,68 +2,40 @@
 # Author: Andrew Werderman
 
 import flask
-from itsdangerous import (TimedJSONWebSignatureSerializer
-							as Serializer, BadSignature,
-							SignatureExpired)
 from flask import (
 	Flask, redirect, url_for, request, render_template, Response, jsonify 
 	)
-from passlib.apps import custom_app_context as pwd_context
 from flask_restful import Resource, Api, abort
-from basicauth import decode as authDecode
-from flask_login import LoginManager, login_required, login_user
-from flask_wtf import CSRFProtect
-from pymongo import MongoClient
-from functools import wraps
-import base64
-import arrow
+from flask_login import login_required, login_user, logout_user
+import brevetlib  # Shared brevet/user data access
+from auth import User, init_login
+# arrow and bulk_users are imported by the routes that use them, as
+# most requests need neither
 
 
+# Queued JSON logging (LOG_LEVEL, LOG_SAMPLING)
+brevetlib.configure_from_env()
+
 # Instantiate the app
 app = Flask(__name__)
 api = Api(app=app, catch_all_404s=True)
-app.config['SECRET_KEY'] = 'the quick brown fox jumps over the lazy dog'
+brevetlib.defer_schema(app)  # Indexes and migrations, on the first request
+
+# Index of control open windows, shared by all requests of this process
+open_controls = brevetlib.OpenControls()
 
-# Create Mongo instance
-client = MongoClient('mongodb://mongo:27017/')
-brevetdb = client['brevetdb'] 
-usersdb = client['usersdb']
+# Per-brevet totals, cached until the brevet's version changes
+summaries = brevetlib.SummaryCache()
 
-# Initialize Login Manager
-login_manager = LoginManager()
-login_manager.init_app(app)
+# Initialize Login Manager (and the session secret)
+login_manager = init_login(app)
 
 
 class Home(Resource):
 	def get(self):
 		return ''
 
-class User():
-	def __init__(self, user_id):
-		self.user_id = user_id
-		
-	def is_authenticated(self):
-		return True
-
-	def is_active(self):
-		return True
-
-	def is_anonymous(self):
-		return False
-
-	def get_id(self):
-		return str(self.user_id)
-
-
-@login_manager.user_loader
-def load_user(user_id):
-	return User(user_id)
-
-
 class Register(Resource):
-	def __init__(self):
-		self.collection = usersdb['UserInfo']
-
 	def post(self):
 		'''
 		Function executed on a POST request to register. If the username is not
@@ -86,15 +58,15 @@ class Register(Resource):
 			return {'Error': 'Please provide a username and password.'}, 400
 
 		# Handle username is already in use. (True: return appropriate message)
-		if (self.collection.find_one({'username': username})):
+		if (brevetlib.find_user(username)):
 			# Bad Request is returned
 			return {'Error': '{} already in use.'.format(username)}, 400
 
-		hVal = pwd_context.encrypt(password)
-		self.collection.insert_one({'username': username, 'password': hVal})
-		new_user = self.collection.find_one({'username': username})
+		import arrow
+		hVal = brevetlib.hash_password(password)
+		user_id = brevetlib.add_user(username, hVal)
 		# Format response
-		info = {'location': str(new_user['_id']), 
+		info = {'location': str(user_id), 
 				'username': username, 
 				'date_added': arrow.now().for_json()}
 		response = flask.jsonify(info)
@@ -102,10 +74,38 @@ class Register(Resource):
 		return response
 
 
-class Login(Resource):
-	def __init__(self):
-		self.collection = usersdb['UserInfo']
+class BulkRegister(Resource):
+	@login_required
+	def post(self):
+		'''
+		Registers many users at once from an uploaded CSV (username,password
+		columns) or JSON list of {username, password}; see bulk_users.py.
+		Returns 201 with the number inserted and the rows that were
+		duplicates, invalid or failed.
+
+		USE: curl -b cookies -F "file=@riders.csv" localhost:5001/api/register/bulk
+		     curl -b cookies -H "Content-Type: application/json" --data @riders.json localhost:5001/api/register/bulk
+		'''
+		import bulk_users
+		try:
+			upload = request.files.get('file')
+			if upload:
+				text = bulk_users.decode_upload(upload.read())
+				fmt = 'json' if (upload.filename or '').endswith('.json') else 'csv'
+			else:
+				text = request.get_data(as_text=True)
+				fmt = 'json' if request.mimetype == 'application/json' else 'csv'
+			users = bulk_users.parse_users(text, fmt)
+			report = bulk_users.provision(users)
+		except ValueError as err:
+			return {'Error': str(err)}, 400
+
+		response = flask.jsonify(report)
+		response.status_code = 201
+		return response
 
+
+class Login(Resource):
 	def post(self):
 		'''
 		USE: curl -d "username=<username>&password=<password>" localhost:5001/api/login
@@ -117,7 +117,7 @@ class Login(Resource):
 		if ((username == None) or (username == '')) or ((password == None) or (password == '')):
 			return {'Error': 'Please provide a username and password.'}, 400
 
-		user = self.collection.find_one({'username': username})
+		user = brevetlib.find_user(username)
 
 		# Handle username is already in use. (True: return appropriate message)
 		if not user:
@@ -126,7 +126,7 @@ class Login(Resource):
 
 		hashVal = user['password']
 
-		if pwd_context.verify(password, hashVal):
+		if brevetlib.verify_password(password, hashVal):
 			obj = User(user['_id'])
 			login_user(obj, remember=True)
 			return 'User successfully logged in.', 200
@@ -144,9 +144,6 @@ class Logout(Resource):
 # Can only be accessed when logged in.
 class ListBrevet(Resource):
 	# All functions in this class must come from an authenticated user
-	def __init__(self):
-		self.collection = brevetdb['brevet'] 
-
 	@login_required
 	def get(self, items='listAll', resultFormat='json'):
 		'''
@@ -162,73 +159,58 @@ class ListBrevet(Resource):
 		'''
 		top = request.args.get('top')
 
-		# Handle empty brevet
-		if self.collection.count() == 0:
-			return jsonify({'Error': 'Empty Brevet'})
-
-		# Handle unexpected query.
-		if (items not in ['listAll', 'listOpenOnly', 'listCloseOnly']) or (resultFormat not in ['json', 'csv']):
-			return jsonify({'Error': 'Invalid Query'})
-
-		# Handle whether top is set or not
-		if (top == None) or (top == ''):
-			controls = self.collection.find()
-		else:
-			# Handle invalid input for top
-			try:
-				limit = int(top)
-				if(limit <= 0):
-					return jsonify({'Error': 'Invalid number of top elements'})
-				else:
-					controls = self.collection.find(limit=limit) # limits the number of results in find()
-			except ValueError:
-				return jsonify({'Error': 'Value Error for top'})
-
-		# Populate results with queried output
-		if (items == 'listAll'):
-			result = ListBrevet.formatResponse(controls, resultFormat, 'open_time', 'close_time')
-		elif (items == 'listOpenOnly'):
-			result = ListBrevet.formatResponse(controls, resultFormat, 'open_time')
-		else: # resultFormat == 'listCloseOnly'
-			result = ListBrevet.formatResponse(controls, resultFormat, 'close_time')
-		
+		# Empty brevet, unexpected query or invalid top (see brevetlib.list_controls)
+		try:
+			result = brevetlib.list_controls(items, resultFormat, top)
+		except brevetlib.QueryError as err:
+			return jsonify({'Error': str(err)})
+
 		if (resultFormat == 'csv'):
 			return Response(result, mimetype='text/csv')
 
 		return jsonify(result)
 
-	def formatResponse(brevet, resultFormat, *args):
+
+class OpenAt(Resource):
+	@login_required
+	def get(self):
 		'''
-		  Input: 
-		  	brevet - the db brevet collection instance
-		  	resultFormat - the desired output format of the query -- 'json' or 'csv'
-		  	*args - the key values of the desired control information -- 'open_time'/'close_time'/etc.
-		  Output: 
-		  	json - an array of dictionaries of control info
-		  	csv - A string formatted to csv
-		  Helper function to format the queried resultFormat of controls.
+		Controls, across all brevets, that are open at time t.
+		  Input:
+			t - ISO 8601 date-time (default: now); without a time zone it is taken as UTC
+		  Output:
+			array of controls (brevet_id, control_km, control_location,
+			open_time, close_time), by brevet and then control_km
+
+		USE: curl -b cookies localhost:5001/openAt?t=2018-06-01T12:00
 		'''
-		json = []
-		csv = ''
-		if (resultFormat == 'json'):
-			for ctrl in brevet:
-				# Could possibly be given two args (open_time/close_time) aka 'key', 
-				# add each to a dictionary and append control
-				jsonDict = {key:ctrl[key] for key in args}
-				json.append(jsonDict)
-		else:
-			csv += str(args[0]) # First argument of format
-			if (len(args) > 1):
-				csv += ', {}\n'.format(args[1]) # If two arguments are given, add the second to the first line
-				for ctrl in brevet:
-					csv += '{}, {}\n'.format(ctrl[args[0]], ctrl[args[1]])	# Add all controls in csv format
-			else:
-				csv += '\n'
-				for ctrl in brevet:
-					csv += '{}\n'.format(ctrl[args[0]])	# Else, add all the singleton control values in csv
+		import arrow
+		t = request.args.get('t')
+		try:
+			when = arrow.utcnow() if (t == None) or (t == '') else arrow.get(t)
+		except (arrow.parser.ParserError, ValueError):
+			return jsonify({'Error': 'Invalid time'})
+
+		controls = open_controls.open_at(when.to('utc').naive)
+		return jsonify(brevetlib.encode_controls(controls, 'json', brevetlib.intervals.OPEN_FIELDS))
+
 
-		output = {'json': json, 'csv': csv}
-		return output[resultFormat]
+class Summary(Resource):
+	@login_required
+	def get(self, brevet_id=None):
+		'''
+		Totals for one brevet, or for every brevet, computed by Mongo.
+		  Output:
+			array of {brevet_id, version, controls, max_km,
+			earliest_open, latest_close}
+
+		USE: curl -b cookies localhost:5001/summary
+		     curl -b cookies localhost:5001/summary/<brevet_id>
+		'''
+		result = summaries.summarize(brevet_id)
+		if (brevet_id != None) and (result == []):
+			return {'Error': 'No brevet {}'.format(brevet_id)}, 404
+		return jsonify(result)
 
 
 # Create routes
@@ -236,6 +218,9 @@ api.add_resource(Home, '/')
 api.add_resource(Login, '/api/login')
 api.add_resource(Logout, '/api/logout')
 api.add_resource(Register, '/api/register')
+api.add_resource(BulkRegister, '/api/register/bulk')
+api.add_resource(OpenAt, '/openAt')
+api.add_resource(Summary, '/summary', '/summary/<brevet_id>')
 api.add_resource(ListBrevet, '/<items>', '/<items>/<resultFormat>')
 
 # Run the application
@@ -0,0 +1,329 @@
+# Brevet RESTful API, asyncio variant
+# Author: Andrew Werderman
+
+'''
+The routes of api.py as an ASGI application, so a worker is not held
+while Mongo answers or a password is hashed.  Users and the control
+lists are read and written with the async driver (brevetlib.aio);
+hashing runs in bulk_users' process pool; the remaining routes (openAt,
+summary, bulk registration) run their blocking calls on a thread.
+
+Responses are the same as api.py's, byte for byte: routing, login
+sessions and response encoding are done by a Flask app that is never
+served (toolkit, below) with the same url rules, flask_login setup and
+flask_restful error handling.  A login cookie from either variant is
+accepted by the other, so deployments can switch freely.
+
+USE: uvicorn api_async:app --host 0.0.0.0 --port 80
+	(docker-compose: command: ["-m", "uvicorn", "api_async:app", "--host", "0.0.0.0", "--port", "80"])
+'''
+import asyncio
+import io
+import sys
+import flask_login
+from flask import Flask, request, Response, jsonify
+from flask_restful import Api
+from flask_restful.utils import unpack
+from werkzeug.exceptions import HTTPException
+import arrow
+import brevetlib  # Shared brevet/user data access
+from brevetlib import aio
+import bulk_users
+from auth import User, init_login
+
+
+# Queued JSON logging (LOG_LEVEL, LOG_SAMPLING)
+brevetlib.configure_from_env()
+
+# Routing, sessions and responses only; see the module docstring
+toolkit = Flask(__name__)
+restful = Api(app=toolkit, catch_all_404s=True)
+login_manager = init_login(toolkit)
+
+# As in api.py
+open_controls = brevetlib.OpenControls()
+summaries = brevetlib.SummaryCache()
+
+
+class Reply():
+	'''
+	What a route answers.  It becomes a response (in _respond) only once
+	the route's awaits are done, as jsonify and login_user need Flask's
+	request context, which cannot be held across awaits.
+	  data, status - as a flask_restful Resource method would return them
+	  json - encode data with flask.jsonify, as api.py does, instead
+	  mimetype - send data (a string) as is, e.g. the CSV lists
+	  login - id of the user to log in; logout - log the user out
+	'''
+	def __init__(self, data, status=200, json=False, mimetype=None, login=None, logout=False):
+		self.data = data
+		self.status = status
+		self.json = json
+		self.mimetype = mimetype
+		self.login = login
+		self.logout = logout
+
+
+async def in_thread(func, *args):
+	return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+async def in_hash_pool(func, *args):
+	return await asyncio.get_running_loop().run_in_executor(bulk_users.hash_pool(), func, *args)
+
+
+###
+# Routes (see the Resource of the same name in api.py)
+###
+
+async def home(req):
+	return Reply('')
+
+
+async def register(req):
+	username = req.form.get('username')
+	password = req.form.get('password')
+
+	# Handle invalid inputs
+	if ((username == None) or (username == '')) or ((password == None) or (password == '')):
+		return Reply({'Error': 'Please provide a username and password.'}, 400)
+
+	# Handle username is already in use.
+	if (await aio.find_user(username)):
+		return Reply({'Error': '{} already in use.'.format(username)}, 400)
+
+	hVal = await in_hash_pool(brevetlib.hash_password, password)
+	user_id = await aio.add_user(username, hVal)
+	info = {'location': str(user_id),
+			'username': username,
+			'date_added': arrow.now().for_json()}
+	return Reply(info, 201, json=True)
+
+
+async def bulk_register(req):
+	try:
+		upload = req.uploads.get('file')
+		if upload:
+			filename, data = upload
+			text = bulk_users.decode_upload(data)
+			fmt = 'json' if (filename or '').endswith('.json') else 'csv'
+		else:
+			text = req.get_data(as_text=True)
+			fmt = 'json' if req.mimetype == 'application/json' else 'csv'
+		users = bulk_users.parse_users(text, fmt)
+		report = await in_thread(bulk_users.provision, users)
+	except ValueError as err:
+		return Reply({'Error': str(err)}, 400)
+	return Reply(report, 201, json=True)
+
+
+async def login(req):
+	username = req.form.get('username')
+	password = req.form.get('password')
+
+	# Handle invalid inputs
+	if ((username == None) or (username == '')) or ((password == None) or (password == '')):
+		return Reply({'Error': 'Please provide a username and password.'}, 400)
+
+	user = await aio.find_user(username)
+	if not user:
+		return Reply({'Error': '{} is not a registered username.'.format(username)}, 400)
+
+	if await in_hash_pool(brevetlib.verify_password, password, user['password']):
+		return Reply('User successfully logged in.', 200, login=user['_id'])
+
+	return Reply('Unauthorized.', 401)
+
+
+async def logout(req):
+	return Reply('user successfully logged out.', 200, logout=True)
+
+
+async def list_brevet(req, items='listAll', resultFormat='json'):
+	top = req.args.get('top')
+	try:
+		result = await aio.list_controls(items, resultFormat, top)
+	except brevetlib.QueryError as err:
+		return Reply({'Error': str(err)}, json=True)
+
+	if (resultFormat == 'csv'):
+		return Reply(result, mimetype='text/csv')
+	return Reply(result, json=True)
+
+
+async def open_at(req):
+	t = req.args.get('t')
+	try:
+		when = arrow.utcnow() if (t == None) or (t == '') else arrow.get(t)
+	except (arrow.parser.ParserError, ValueError):
+		return Reply({'Error': 'Invalid time'}, json=True)
+
+	controls = await in_thread(open_controls.open_at, when.to('utc').naive)
+	return Reply(brevetlib.encode_controls(controls, 'json', brevetlib.intervals.OPEN_FIELDS), json=True)
+
+
+async def summary(req, brevet_id=None):
+	result = await in_thread(summaries.summarize, brevet_id)
+	if (brevet_id != None) and (result == []):
+		return Reply({'Error': 'No brevet {}'.format(brevet_id)}, 404)
+	return Reply(result, json=True)
+
+
+# (rule(s), endpoint, methods, route, login required) in api.py's order;
+# endpoints are named as flask_restful names the Resources
+ROUTES = [
+	(['/'], 'home', ['GET'], home, False),
+	(['/api/login'], 'login', ['POST'], login, False),
+	(['/api/logout'], 'logout', ['GET'], logout, True),
+	(['/api/register'], 'register', ['POST'], register, False),
+	(['/api/register/bulk'], 'bulkregister', ['POST'], bulk_register, True),
+	(['/openAt'], 'openat', ['GET'], open_at, True),
+	(['/summary', '/summary/<brevet_id>'], 'summary', ['GET'], summary, True),
+	(['/<items>', '/<items>/<resultFormat>'], 'listbrevet', ['GET'], list_brevet, True),
+]
+HANDLERS = {}
+for rules, endpoint, methods, route, protected in ROUTES:
+	for rule in rules:
+		toolkit.add_url_rule(rule, endpoint, methods=methods)
+	restful.endpoints.add(endpoint)
+	HANDLERS[endpoint] = (route, protected)
+
+
+###
+# ASGI
+###
+
+def _environ(scope, body):
+	'''The WSGI environ Flask would see for this request.'''
+	server = scope.get('server') or ('localhost', 80)
+	environ = {
+		'REQUEST_METHOD': scope['method'],
+		'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+		'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+		'QUERY_STRING': scope['query_string'].decode('latin-1'),
+		'SERVER_NAME': server[0],
+		'SERVER_PORT': str(server[1]),
+		'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+		'CONTENT_LENGTH': str(len(body)),
+		'wsgi.version': (1, 0),
+		'wsgi.url_scheme': scope.get('scheme', 'http'),
+		'wsgi.input': io.BytesIO(body),
+		'wsgi.errors': sys.stderr,
+		'wsgi.multithread': False,
+		'wsgi.multiprocess': False,
+		'wsgi.run_once': False,
+	}
+	if scope.get('client'):
+		environ['REMOTE_ADDR'] = scope['client'][0]
+	for name, value in scope['headers']:
+		name = name.decode('latin-1').upper().replace('-', '_')
+		value = value.decode('latin-1')
+		if name == 'CONTENT_LENGTH':
+			continue
+		key = name if name == 'CONTENT_TYPE' else 'HTTP_' + name
+		environ[key] = environ[key] + ',' + value if key in environ else value
+	return environ
+
+
+def _route(environ):
+	'''
+	Matches the request and checks its login, as Flask and flask_login
+	would.  Returns (route, request, url arguments), or (None, response)
+	for a request that does not reach a route.  Uploaded files are closed
+	with the context, so their contents are kept as request.uploads,
+	{field name: (filename, bytes)}.
+	'''
+	with toolkit.request_context(environ):
+		try:
+			if request.routing_exception is not None:
+				raise request.routing_exception
+			if request.method == 'OPTIONS':
+				return None, toolkit.process_response(toolkit.make_default_options_response())
+			route, protected = HANDLERS[request.url_rule.endpoint]
+			if protected and not flask_login.current_user.is_authenticated:
+				login_manager.unauthorized()  # Aborts
+			request.form  # Parse the body while Flask's context is there
+			request.uploads = {name: (upload.filename, upload.read())
+							for name, upload in request.files.items()}
+			return route, request._get_current_object(), request.view_args
+		except HTTPException as err:
+			response = toolkit.make_response(toolkit.handle_user_exception(err))
+			return None, toolkit.process_response(response)
+
+
+def _respond(environ, reply):
+	'''Turns a Reply into a response, as flask_restful and Flask would.'''
+	with toolkit.request_context(environ):
+		try:
+			if reply.login is not None:
+				flask_login.login_user(User(reply.login), remember=True)
+			if reply.logout:
+				flask_login.logout_user()
+			if reply.mimetype:
+				response = Response(reply.data, mimetype=reply.mimetype)
+			elif reply.json:
+				response = jsonify(reply.data)
+				response.status_code = reply.status
+			else:
+				data, code, headers = unpack((reply.data, reply.status))
+				response = restful.make_response(data, code, headers=headers)
+		except HTTPException as err:
+			response = toolkit.make_response(toolkit.handle_user_exception(err))
+		return toolkit.process_response(response)
+
+
+def _fail(environ, err):
+	'''The 500 response Flask gives for an unexpected error.'''
+	with toolkit.request_context(environ):
+		return toolkit.make_response(toolkit.handle_exception(err))
+
+
+async def handle(environ):
+	'''Answers one request; returns a Flask response.'''
+	routed = _route(environ)
+	if routed[0] is None:
+		return routed[1]
+	route, req, args = routed
+	try:
+		reply = await route(req, **args)
+	except Exception as err:
+		return _fail(environ, err)
+	return _respond(environ, reply)
+
+
+async def _read_body(receive):
+	body = b''
+	more = True
+	while more:
+		message = await receive()
+		body += message.get('body', b'')
+		more = message.get('more_body', False)
+	return body
+
+
+async def app(scope, receive, send):
+	if scope['type'] == 'lifespan':
+		while True:
+			message = await receive()
+			if message['type'] == 'lifespan.startup':
+				# Indexes and migrations, once the server is up rather than at import
+				await in_thread(brevetlib.ensure_schema)
+				await send({'type': 'lifespan.startup.complete'})
+			elif message['type'] == 'lifespan.shutdown':
+				await send({'type': 'lifespan.shutdown.complete'})
+				return
+	if scope['type'] != 'http':
+		return
+
+	environ = _environ(scope, await _read_body(receive))
+	response = await handle(environ)
+	body, status, headers = response.get_wsgi_response(environ)
+	await send({
+		'type': 'http.response.start',
+		'status': int(status.split(' ', 1)[0]),
+		'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+					for name, value in headers],
+	})
+	await send({'type': 'http.response.body', 'body': b''.join(body)})
+	if hasattr(body, 'close'):
+		body.close()
@@ -0,0 +1,40 @@
+# Login sessions for the Brevet RESTful API
+# Author: Andrew Werderman
+
+'''
+The session secret and user class shared by api.py and api_async.py,
+so a login cookie issued by either variant is accepted by the other.
+'''
+from flask_login import LoginManager
+
+SECRET_KEY = 'the quick brown fox jumps over the lazy dog'
+
+
+class User():
+	def __init__(self, user_id):
+		self.user_id = user_id
+		
+	def is_authenticated(self):
+		return True
+
+	def is_active(self):
+		return True
+
+	def is_anonymous(self):
+		return False
+
+	def get_id(self):
+		return str(self.user_id)
+
+
+def init_login(app):
+	'''Sets app's secret key and attaches a LoginManager that loads Users.'''
+	app.config['SECRET_KEY'] = SECRET_KEY
+	login_manager = LoginManager()
+	login_manager.init_app(app)
+
+	@login_manager.user_loader
+	def load_user(user_id):
+		return User(user_id)
+
+	return login_manager
@@ -0,0 +1,143 @@
+# Bulk user provisioning for the Brevet RESTful API
+# Author: Andrew Werderman
+
+'''
+Registers many users at once, e.g. a club's riders from a spreadsheet.
+Passwords are hashed across a process pool and the users are stored
+with one unordered insert; usernames already taken (or repeated in the
+file) come back as per-row duplicates from the unique username index.
+
+Used by the /api/register/bulk route, and from the command line:
+
+USE: python bulk_users.py riders.csv [--workers N]
+	(CSV with username,password columns, or a JSON list of
+	{"username": ..., "password": ...}; MONGO_URI selects the database)
+'''
+import argparse
+import atexit
+import csv
+import io
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import brevetlib
+
+DUPLICATE_KEY = 11000
+MAX_USERS = 5000   # per request/file
+
+# The service hashes on a bounded pool, next to its request workers
+HASH_WORKERS = min(4, os.cpu_count() or 1)
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def decode_upload(data):
+	'''The text of an uploaded file; raises ValueError if it is not UTF-8.'''
+	try:
+		return data.decode('utf-8')
+	except UnicodeDecodeError:
+		raise ValueError('Expected a UTF-8 text file')
+
+
+def parse_users(text, fmt):
+	'''
+	  Input:
+		text - the uploaded file's contents
+		fmt - 'csv' (username,password header) or 'json'
+	  Output:
+		list of (username, password) in file order
+	  Raises ValueError for a file that cannot be read.
+	'''
+	if fmt == 'json':
+		rows = json.loads(text)
+		if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+			raise ValueError('Expected a JSON list of users')
+		return [(str(row.get('username') or ''), str(row.get('password') or '')) for row in rows]
+	reader = csv.DictReader(io.StringIO(text))
+	try:
+		if not reader.fieldnames or not {'username', 'password'} <= set(reader.fieldnames):
+			raise ValueError('Expected username and password columns')
+		return [((row['username'] or '').strip(), row['password'] or '') for row in reader]
+	except csv.Error as err:
+		raise ValueError('Malformed CSV: {}'.format(err))
+
+
+def hash_passwords(passwords, workers=None):
+	'''
+	Hashes passwords in parallel; returns the hashes in the same order.
+	workers - size of a pool made for this call only (the command line);
+		None uses the service's shared hash_pool()
+	'''
+	if workers == 1 or len(passwords) < 2:
+		return [brevetlib.hash_password(password) for password in passwords]
+	if workers is None:
+		return list(hash_pool().map(brevetlib.hash_password, passwords, chunksize=8))
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		return list(pool.map(brevetlib.hash_password, passwords, chunksize=8))
+
+
+def hash_pool():
+	'''
+	The service's process pool for hashing (shared with api_async.py):
+	HASH_WORKERS processes, created on first use and shut down at exit.
+	'''
+	global _pool
+	if _pool is None:
+		with _pool_lock:
+			if _pool is None:
+				_pool = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+				atexit.register(_pool.shutdown)
+	return _pool
+
+
+def provision(users, workers=None):
+	'''
+	  Input:
+		users - list of (username, password) as returned by parse_users
+	  Output:
+		{'inserted': n, 'duplicates': [...], 'invalid': [...], 'failed': [...]}
+		where each list holds {'row', 'username'} (rows numbered from 1)
+	'''
+	report = {'inserted': 0, 'duplicates': [], 'invalid': [], 'failed': []}
+	if len(users) > MAX_USERS:
+		raise ValueError('At most {} users at a time'.format(MAX_USERS))
+
+	rows = []
+	for row, (username, password) in enumerate(users, start=1):
+		if (username == '') or (password == ''):
+			report['invalid'].append({'row': row, 'username': username})
+		else:
+			rows.append((row, username, password))
+
+	hashes = hash_passwords([password for _, _, password in rows], workers)
+	docs = [{'username': username, 'password': hVal}
+			for (_, username, _), hVal in zip(rows, hashes)]
+	inserted, failed = brevetlib.add_users(docs)
+	report['inserted'] = inserted
+	for index, code in sorted(failed.items()):
+		row, username, _ = rows[index]
+		kind = 'duplicates' if code == DUPLICATE_KEY else 'failed'
+		report[kind].append({'row': row, 'username': username})
+	return report
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Register users in bulk")
+	parser.add_argument('file', help="CSV or JSON file of users")
+	parser.add_argument('--format', choices=['csv', 'json'])
+	parser.add_argument('-w', '--workers', type=int, default=os.cpu_count())
+	args = parser.parse_args()
+
+	fmt = args.format or ('json' if args.file.endswith('.json') else 'csv')
+	with open(args.file, newline='') as users_file:
+		users = parse_users(users_file.read(), fmt)
+	brevetlib.ensure_schema()   # The unique username index reports duplicates
+	report = provision(users, args.workers)
+	json.dump(report, sys.stdout, indent=2)
+	print()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,139 @@
+"""
+Nose tests for api_async.py, run against mongomock (with a thin async
+wrapper standing in for pymongo's AsyncMongoClient)
+"""
+import asyncio
+import json
+from datetime import datetime, timedelta
+import mongomock
+from brevetlib import store, aio, listing, schema
+
+
+class AsyncCursor():
+	def __init__(self, cursor):
+		self.cursor = cursor
+
+	async def to_list(self, length):
+		return list(self.cursor)
+
+
+class AsyncCollection():
+	def __init__(self, collection):
+		self.collection = collection
+
+	async def find_one(self, *args, **kwargs):
+		return self.collection.find_one(*args, **kwargs)
+
+	async def insert_one(self, *args, **kwargs):
+		return self.collection.insert_one(*args, **kwargs)
+
+	def find(self, *args, **kwargs):
+		return AsyncCursor(self.collection.find(*args, **kwargs))
+
+
+class AsyncDatabase():
+	def __init__(self, db):
+		self.db = db
+
+	def __getitem__(self, name):
+		return AsyncCollection(self.db[name])
+
+
+class AsyncClient():
+	def __init__(self, client):
+		self.client = client
+
+	def __getitem__(self, name):
+		return AsyncDatabase(self.client[name])
+
+
+def setup_function(function=None):
+	store._client = mongomock.MongoClient()
+	aio._client = AsyncClient(store._client)
+
+
+def call(method, path, body=b'', content_type=None, cookie=None, query=b''):
+	''' One request through the ASGI app; returns (status, headers, body) '''
+	import api_async
+	headers = []
+	if content_type:
+		headers.append((b'content-type', content_type.encode()))
+	if cookie:
+		headers.append((b'cookie', cookie.encode()))
+	scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query,
+			'headers': headers, 'http_version': '1.1', 'scheme': 'http',
+			'server': ('localhost', 80), 'client': ('127.0.0.1', 5555), 'root_path': ''}
+	sent = []
+
+	async def receive():
+		return {'type': 'http.request', 'body': body, 'more_body': False}
+
+	async def send(message):
+		sent.append(message)
+
+	asyncio.run(api_async.app(scope, receive, send))
+	return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+
+def login_cookie():
+	form = 'application/x-www-form-urlencoded'
+	status, _, _ = call('POST', '/api/register', b'username=rider&password=pw12345', form)
+	assert status == 201
+	status, headers, body = call('POST', '/api/login', b'username=rider&password=pw12345', form)
+	assert (status, body) == (200, b'"User successfully logged in."\n')
+	return headers[b'set-cookie'].decode().split(';')[0]
+
+
+def test_register_and_duplicate():
+	''' Registering returns the new user; a taken username is a 400 '''
+	form = 'application/x-www-form-urlencoded'
+	status, _, body = call('POST', '/api/register', b'username=rider&password=pw', form)
+	assert status == 201
+	assert json.loads(body)['username'] == 'rider'
+	assert store.find_user('rider')['password'] != 'pw'
+	status, _, body = call('POST', '/api/register', b'username=rider&password=pw', form)
+	assert (status, json.loads(body)) == (400, {'Error': 'rider already in use.'})
+
+
+def test_lists_need_login():
+	''' Without a session cookie the lists answer 401, as flask_restful does '''
+	status, headers, body = call('GET', '/listAll/json')
+	assert status == 401
+	assert 'message' in json.loads(body)
+
+
+def test_lists_match_blocking_listing():
+	''' The async lists are the blocking ones, JSON or CSV '''
+	start = datetime(2018, 6, 1, 6)
+	store.replace_controls([{'control_km': km, 'control_location': 'c{}'.format(km),
+		'open_time': start + timedelta(hours=km // 30), 'close_time': start + timedelta(hours=km // 15)}
+		for km in (0, 60, 120)])
+	cookie = login_cookie()
+	status, _, body = call('GET', '/listOpenOnly/json', cookie=cookie, query=b'top=2')
+	assert status == 200
+	assert json.loads(body) == listing.list_controls('listOpenOnly', 'json', '2')
+	status, headers, body = call('GET', '/listAll/csv', cookie=cookie)
+	assert headers[b'content-type'].startswith(b'text/csv')
+	assert body.decode() == listing.list_controls('listAll', 'csv')
+	_, _, body = call('GET', '/listAll/xml', cookie=cookie)
+	assert json.loads(body) == {'Error': 'Invalid Query'}
+
+
+def test_bulk_register_upload_and_body():
+	''' Users come from an uploaded file (as curl -F sends it) or from the request body '''
+	schema.ensure_schema()  # Duplicates are reported by the unique username index
+	cookie = login_cookie()
+	boundary = 'brevetboundary'
+	body = ('--{0}\r\nContent-Disposition: form-data; name="file"; filename="riders.csv"\r\n'
+		'Content-Type: text/csv\r\n\r\nusername,password\r\nrider1,pw1\r\nrider,pw2\r\n'
+		'--{0}--\r\n').format(boundary).encode()
+	status, _, reply = call('POST', '/api/register/bulk', body,
+		'multipart/form-data; boundary=' + boundary, cookie=cookie)
+	assert status == 201
+	assert json.loads(reply) == {'inserted': 1, 'duplicates': [{'row': 2, 'username': 'rider'}],
+		'invalid': [], 'failed': []}
+	body = json.dumps([{'username': 'rider2', 'password': 'pw'}]).encode()
+	status, _, reply = call('POST', '/api/register/bulk', body, 'application/json', cookie=cookie)
+	assert (status, json.loads(reply)['inserted']) == (201, 1)
+	status, _, reply = call('POST', '/api/register/bulk', b'[1]', 'application/json', cookie=cookie)
+	assert (status, json.loads(reply)) == (400, {'Error': 'Expected a JSON list of users'})
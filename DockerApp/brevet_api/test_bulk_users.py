@@ -0,0 +1,90 @@
+"""
+Nose tests for bulk_users.py, run against mongomock
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import mongomock
+import brevetlib
+from brevetlib import store, schema
+import bulk_users
+
+
+def setup_function(function=None):
+	store._client = mongomock.MongoClient()
+
+
+def test_parse_csv_and_json():
+	''' Both formats give (username, password) in file order '''
+	text = 'username,password,club\n rider1 ,pw1,x\nrider2,,y\n'
+	assert bulk_users.parse_users(text, 'csv') == [('rider1', 'pw1'), ('rider2', '')]
+	text = json.dumps([{'username': 'rider1', 'password': 'pw1'}, {'username': 'rider2'}])
+	assert bulk_users.parse_users(text, 'json') == [('rider1', 'pw1'), ('rider2', '')]
+
+
+def test_malformed_files_are_value_errors():
+	''' Anything that is not a list of users is a ValueError, i.e. a 400 '''
+	bad = [('name,pass\na,b\n', 'csv'), ('', 'csv'), ('{"username": "a"}', 'json'),
+		('["a", "b"]', 'json'), ('[{"username": "a"}, 3]', 'json'), ('[{', 'json')]
+	for text, fmt in bad:
+		try:
+			bulk_users.parse_users(text, fmt)
+			assert False, 'accepted {!r}'.format(text)
+		except ValueError:
+			pass
+	try:
+		bulk_users.decode_upload('username,password\n\xe9,x\n'.encode('latin-1'))
+		assert False, 'accepted latin-1'
+	except ValueError:
+		pass
+
+
+def test_provision_reports_rows():
+	''' Taken, repeated and incomplete rows are reported by row number; the rest are stored '''
+	schema.ensure_schema()
+	store.add_user('taken', 'x')
+	users = [('a', 'pw'), ('taken', 'pw'), ('b', ''), ('a', 'pw'), ('c', 'pw')]
+	report = bulk_users.provision(users, workers=1)
+	assert report == {'inserted': 2,
+		'duplicates': [{'row': 2, 'username': 'taken'}, {'row': 4, 'username': 'a'}],
+		'invalid': [{'row': 3, 'username': 'b'}],
+		'failed': []}
+	assert brevetlib.verify_password('pw', store.find_user('c')['password'])
+
+
+def test_provision_limit():
+	''' More than MAX_USERS at once is refused before anything is hashed '''
+	try:
+		bulk_users.provision([('a', 'pw')] * (bulk_users.MAX_USERS + 1))
+		assert False, 'accepted too many users'
+	except ValueError:
+		pass
+	assert store.user_collection().count_documents({}) == 0
+
+
+def test_hash_passwords_keeps_order():
+	''' A pool made for the call returns the hashes in the order given '''
+	passwords = ['pw{}'.format(i) for i in range(4)]
+	hashes = bulk_users.hash_passwords(passwords, workers=2)
+	assert all(brevetlib.verify_password(p, h) for p, h in zip(passwords, hashes))
+
+
+def test_command_line():
+	''' The CLI provisions a JSON file and prints the report '''
+	folder = tempfile.mkdtemp()
+	path = os.path.join(folder, 'riders.json')
+	with open(path, 'w') as users_file:
+		json.dump([{'username': 'a', 'password': 'pw'}, {'username': 'a', 'password': 'pw'}], users_file)
+	argv = sys.argv
+	sys.argv = ['bulk_users.py', path, '-w', '1']
+	out = io.StringIO()
+	try:
+		with contextlib.redirect_stdout(out):
+			bulk_users.main()
+	finally:
+		sys.argv = argv
+	assert json.loads(out.getvalue())['duplicates'] == [{'row': 2, 'username': 'a'}]
+	assert store.find_user('a') is not None
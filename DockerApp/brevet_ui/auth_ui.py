@@ -5,24 +5,29 @@ from flask import (
 	Flask, redirect, url_for, request, render_template, Response, jsonify 
 	)
 from wtforms import StringField, PasswordField, BooleanField
-from passlib.apps import custom_app_context as pwd_context
 from wtforms.validators import InputRequired, Length 
 from flask_wtf import FlaskForm, CSRFProtect
 from flask_login import LoginManager, login_required, login_user, logout_user
-from pymongo import MongoClient
-import pymongo
 import flask
+import json
+import queue
+import brevetlib  # Shared brevet/user data access
+
+# Queued JSON logging (LOG_LEVEL, LOG_SAMPLING)
+brevetlib.configure_from_env()
 
 # Instantiate the app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'the quick brown fox jumps over the lazy dog'
+brevetlib.defer_schema(app)  # Indexes and migrations, on the first request
+brevetlib.cache_templates(app)  # Compiled templates kept across processes
+
+# Content-hashed, immutably cached static files; templates use asset_url()
+assets = brevetlib.AssetManifest(app)
 
-# Create Mongo instance
-client = MongoClient('mongodb://mongo:27017/')
-brevetdb = client['brevetdb'] 
-usersdb = client['usersdb']
-BREVET_COLLECTION = brevetdb['brevet']  
-USER_COLLECTION = usersdb['UserInfo']
+# One watcher per process for all open event streams (see /_events)
+notifier = brevetlib.BrevetNotifier()
+EVENT_HEARTBEAT = 15  # seconds between keep-alive comments
 
 # Initialize Login Manager
 login_manager = LoginManager()
@@ -81,38 +86,42 @@ def listBrevet(items='listAll', resultFormat='json'):
 	top = request.args.get('top')
 	app.logger.debug('function called.')
 
-	# Handle empty brevet
-	if BREVET_COLLECTION.count() == 0:
-		return jsonify(result={'Error': 'Empty Brevet'})
+	# Empty brevet, unexpected query or invalid top (see brevetlib.list_controls)
+	try:
+		result = brevetlib.list_controls(items, resultFormat, top, line_break='<br>')
+	except brevetlib.QueryError as err:
+		return jsonify(result={'Error': str(err)})
+	
+	app.logger.debug('listBrevet result: %s', result)  # formatted only if DEBUG is enabled
+	return jsonify(result=result, form=resultFormat)
 
-	# Handle unexpected query.
-	if (items not in ['listAll', 'listOpenOnly', 'listCloseOnly']) or (resultFormat not in ['json', 'csv']):
-		return jsonify(result={'Error': 'Invalid Query'})
 
-	# Handle whether top is set or not
-	if (top == None) or (top == ''):
-		controls = BREVET_COLLECTION.find()
-	else:
-		# Handle invalid input for top
+@app.route('/_events')
+@login_required
+def events():
+	'''
+	Server-sent events: a 'brevet' event with {"brevet_id", "version"}
+	whenever a brevet is changed, so pages refresh their lists only when
+	there is something new instead of polling.
+	'''
+	def stream():
+		subscription = notifier.subscribe()
 		try:
-			limit = int(top)
-			if(limit <= 0):
-				return jsonify(result={'Error': 'Invalid number of top elements'})
-			else:
-				controls = BREVET_COLLECTION.find(limit=limit) # limits the number of results in find()
-		except ValueError:
-			return jsonify(result={'Error': 'Value Error for top'})
-
-	# Populate results with queried output
-	if (items == 'listAll'):
-		result = formatResponse(controls, resultFormat, 'open_time', 'close_time')
-	elif (items == 'listOpenOnly'):
-		result = formatResponse(controls, resultFormat, 'open_time')
-	else: # resultFormat == 'listCloseOnly'
-		result = formatResponse(controls, resultFormat, 'close_time')
-	
-	app.logger.debug(result)
-	return jsonify(result=result, form=resultFormat)
+			yield 'retry: 5000\n\n'
+			while True:
+				try:
+					event = subscription.get(timeout=EVENT_HEARTBEAT)
+				except queue.Empty:
+					yield ': keep-alive\n\n'
+					continue
+				yield 'event: brevet\nid: {}\ndata: {}\n\n'.format(event['version'], json.dumps(event))
+		finally:
+			notifier.unsubscribe(subscription)
+
+	response = Response(flask.stream_with_context(stream()), mimetype='text/event-stream')
+	response.headers['Cache-Control'] = 'no-cache'
+	response.headers['X-Accel-Buffering'] = 'no'  # Don't let a proxy buffer the stream
+	return response
 
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -124,10 +133,8 @@ def register():
 		username = form.username.data
 		password = form.password.data
 		if not is_taken(username):
-			hVal = pwd_context.encrypt(password)
-			USER_COLLECTION.insert_one({'username': username, 'password': hVal})
-			new_user = USER_COLLECTION.find_one({'username': username})
-			user_obj = User(new_user['_id'])
+			hVal = brevetlib.hash_password(password)
+			user_obj = User(brevetlib.add_user(username, hVal))
 			login_user(user_obj, remember=True)
 			return redirect(url_for('index'))
 	return render_template('register.html', form=form)
@@ -144,7 +151,7 @@ def login():
 		user = is_taken(username)
 		if user:
 			app.logger.debug("user exists")
-			if is_valid_password(username, password):
+			if brevetlib.verify_password(password, user['password']):
 				obj = User(user['_id'])
 				login_user(obj, remember=True)
 				return redirect(url_for('index'))
@@ -176,51 +183,14 @@ def unauthorized_callback():
 
 def is_taken(username):
 	'''
+	Returns the user's document if username is registered, else False.
 	'''
-	user_obj = USER_COLLECTION.find_one({'username': username})
+	user_obj = brevetlib.find_user(username)
 	if user_obj:
 		return user_obj
 	else:
 		return False
 
-def is_valid_password(username, password):
-	user_obj = USER_COLLECTION.find_one({'username': username})
-	hashVal = user_obj['password']
-	return pwd_context.verify(password, hashVal)
-
-def formatResponse(brevet, resultFormat, *args):
-		'''
-		  Input: 
-		  	brevet - the db brevet collection instance
-		  	resultFormat - the desired output format of the query -- 'json' or 'csv'
-		  	*args - the key values of the desired control information -- 'open_time'/'close_time'/etc.
-		  Output: 
-		  	json - an array of dictionaries of control info
-		  	csv - A string formatted to csv
-		  Helper function to format the queried resultFormat of controls.
-		'''
-		json = []
-		csv = ''
-		if (resultFormat == 'json'):
-			for ctrl in brevet:
-				# Could possibly be given two args (open_time/close_time) aka 'key', 
-				# add each to a dictionary and append control
-				jsonDict = {key:ctrl[key] for key in args}
-				json.append(jsonDict)
-		else:
-			csv += str(args[0]) # First argument of format
-			if (len(args) > 1):
-				csv += ', {}<br>'.format(args[1]) # If two arguments are given, add the second to the first line
-				for ctrl in brevet:
-					csv += '{}, {}<br>'.format(ctrl[args[0]], ctrl[args[1]])	# Add all controls in csv format
-			else:
-				csv += '<br>'
-				for ctrl in brevet:
-					csv += '{}<br>'.format(ctrl[args[0]])	# Else, add all the singleton control values in csv
-
-		output = {'json': json, 'csv': csv}
-		return output[resultFormat]
-
 ###############################
 
 
@@ -229,5 +199,6 @@ if __name__ == '__main__':
     	host='0.0.0.0', 
     	port=5000, 
     	debug=True,
+    	threaded=True,  # /_events streams hold a thread each
     	extra_files = ['./templates/register.html', './templates/login.html'])
 
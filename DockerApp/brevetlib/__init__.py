@@ -0,0 +1,56 @@
+"""
+Shared brevet data access for flask_app (brevet), api (brevet_api)
+and auth_ui (brevet_ui).
+
+This package owns the Mongo client and the brevet and user collections,
+and knows how to query and encode controls, so the three services no
+longer each carry their own copy.  Each service image copies it next to
+its own code (see the Dockerfiles); locally, put DockerApp on PYTHONPATH.
+
+Logging and the store are imported with the package.  Everything else
+is imported the first time one of its names is used (brevetlib.X, or
+from brevetlib import X), so a service only loads the features it uses.
+"""
+import importlib
+from brevetlib.applog import configure_logging, configure_from_env
+from brevetlib.store import (
+    get_client, brevet_collection, user_collection,
+    has_controls, find_controls, replace_controls, clear_controls,
+    bump_version, brevet_version, brevet_versions,
+    find_user, add_user, add_users
+)
+
+# name -> module it is imported from on first use
+_LAZY = {}
+for _module, _names in [
+    ('listing', ('QueryError', 'LIST_FIELDS', 'RESULT_FORMATS', 'parse_top', 'parse_query',
+                 'list_controls', 'encode_value', 'encode_controls')),
+    ('schema', ('ensure_schema', 'SCHEMA_VERSION')),
+    ('intervals', ('IntervalIndex', 'OpenControls')),
+    ('model', ('Control', 'Brevet')),
+    ('notify', ('BrevetNotifier',)),
+    ('writebehind', ('WriteBehindQueue', 'QueueFull', 'parse_write_concern')),
+    ('summary', ('SummaryCache',)),
+    ('assets', ('AssetManifest',)),
+    ('pages', ('ControlPage', 'PageCache')),
+    ('startup', ('defer_schema', 'cache_templates')),
+    ('passwords', ('hash_password', 'verify_password')),
+]:
+    for _name in _names:
+        _LAZY[_name] = _module
+del _module, _names, _name
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module('brevetlib.' + _LAZY[name]), name)
+    elif name in _LAZY.values():
+        value = importlib.import_module('brevetlib.' + name)   # e.g. brevetlib.intervals
+    else:
+        raise AttributeError("module 'brevetlib' has no attribute {!r}".format(name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
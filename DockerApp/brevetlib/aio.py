@@ -0,0 +1,61 @@
+"""
+Asyncio counterparts of the store and listing queries, for the ASGI
+variant of brevet_api (brevet_api/api_async.py).
+
+They run on pymongo's AsyncMongoClient (pymongo 4.13 or later), created
+on first use from MONGO_URI like store's client, and answer exactly as
+their blocking counterparts do.
+"""
+import os
+from brevetlib import store
+from brevetlib.listing import QueryError, parse_query, encode_controls
+
+_client = None
+
+
+def get_client():
+    """Returns the process-wide AsyncMongoClient, creating it on first use."""
+    global _client
+    if _client is None:
+        # Imported here so the blocking services work with older pymongo
+        from pymongo import AsyncMongoClient
+        _client = AsyncMongoClient(os.environ.get('MONGO_URI', store.DEFAULT_MONGO_URI))
+    return _client
+
+
+def brevet_collection():
+    return get_client()[store.BREVET_DB][store.BREVET_COLLECTION]
+
+
+def user_collection():
+    return get_client()[store.USERS_DB][store.USER_COLLECTION]
+
+
+async def has_controls():
+    return await brevet_collection().find_one({}, {'_id': 1}) is not None
+
+
+async def find_controls(fields=store.CONTROL_FIELDS, limit=0, brevet_id=None):
+    """Like store.find_controls, but returns a list."""
+    query = {} if brevet_id is None else {'brevet_id': brevet_id}
+    cursor = brevet_collection().find(query, store.projection(fields),
+                                      sort=store.CONTROL_ORDER, limit=limit)
+    return await cursor.to_list(None)
+
+
+async def list_controls(items, resultFormat, top=None, line_break='\n'):
+    """See listing.list_controls."""
+    if not await has_controls():
+        raise QueryError('Empty Brevet')
+    fields, limit = parse_query(items, resultFormat, top)
+    controls = await find_controls(fields, limit=limit)
+    return encode_controls(controls, resultFormat, fields, line_break)
+
+
+async def find_user(username):
+    return await user_collection().find_one({'username': username})
+
+
+async def add_user(username, password_hash):
+    result = await user_collection().insert_one({'username': username, 'password': password_hash})
+    return result.inserted_id
@@ -0,0 +1,136 @@
+"""
+Logging shared by the three services.
+
+configure_logging hands records to a queue on the calling thread; a
+single listener thread formats them as JSON lines and writes them, so
+request handlers never block on formatting or I/O.  Noisy loggers can
+be sampled (see SamplingFilter).
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+_listener = None   # The running QueueListener, if configure_logging was called
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of the records from selected loggers.
+
+    rates maps a logger name to the fraction (0.0 - 1.0) of its records
+    to keep; the longest matching dotted prefix wins, so 'werkzeug'
+    also governs 'werkzeug.serving'.  Unlisted loggers and records at
+    WARNING or above are always kept.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+
+    def rate_for(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener.
+
+    The stock QueueHandler.prepare() merges msg and args on the calling
+    thread; we only copy the record, so the (possibly large) payload is
+    turned into text on the listener thread.  Arguments must therefore
+    not be mutated after they are logged.
+    """
+
+    def prepare(self, record):
+        return logging.makeLogRecord(record.__dict__)
+
+
+def parse_sampling(spec):
+    """Parse 'name=rate,name=rate' (as found in app.ini) into a dict."""
+    rates = {}
+    if not spec:
+        return rates
+    for item in str(spec).split(','):
+        name, _, rate = item.partition('=')
+        if name.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def configure_logging(level=logging.INFO, sampling=None, stream=None):
+    """
+    Route all logging through a queue to a JSON-writing listener thread.
+
+    Replaces the root logger's handlers (e.g. basicConfig's).  sampling is a
+    dict or a 'name=rate,...' string (see SamplingFilter); records that
+    are sampled out are dropped before they reach the queue.  Safe to
+    call more than once; the previous listener is stopped first.
+    """
+    _stop_logging()
+
+    if isinstance(sampling, str):
+        sampling = parse_sampling(sampling)
+
+    log_queue = queue.Queue(-1)
+    queue_handler = DeferredQueueHandler(log_queue)
+    if sampling:
+        queue_handler.addFilter(SamplingFilter(sampling))
+
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    global _listener
+    _listener = logging.handlers.QueueListener(log_queue, output)
+    _listener.start()
+    return _listener
+
+
+@atexit.register
+def _stop_logging():
+    """Flush whatever is still queued and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configure_from_env():
+    """
+    configure_logging from LOG_LEVEL (default INFO) and LOG_SAMPLING
+    ('name=rate,...'), for the services that have no app.ini.
+    """
+    return configure_logging(level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+                             sampling=os.environ.get('LOG_SAMPLING'))
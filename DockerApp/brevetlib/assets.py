@@ -0,0 +1,65 @@
+"""
+Fingerprinted static assets.
+
+At startup AssetManifest hashes every file under the app's static folder
+and serves each one at a URL carrying its content hash, e.g.
+/assets/js/moment.min.3f2a9c1b7d4e.js, with a year-long immutable
+Cache-Control.  A changed file gets a new URL, so browsers never need
+to revalidate.  Templates resolve URLs with asset_url('js/moment.min.js');
+files missing from the manifest fall back to the plain static route.
+"""
+import hashlib
+import os
+import flask
+
+HASH_LENGTH = 12
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def fingerprint(path, digest):
+    """'js/app.js' -> 'js/app.<digest>.js' (the hash goes before the extension)."""
+    root, ext = os.path.splitext(path)
+    return '{}.{}{}'.format(root, digest[:HASH_LENGTH], ext)
+
+
+def build_manifest(folder):
+    """Maps each file's path under folder (with '/' separators) to its fingerprinted path."""
+    manifest = {}
+    for directory, _, files in os.walk(folder):
+        for name in files:
+            path = os.path.join(directory, name)
+            with open(path, 'rb') as asset:
+                digest = hashlib.sha256(asset.read()).hexdigest()
+            rel = os.path.relpath(path, folder).replace(os.sep, '/')
+            manifest[rel] = fingerprint(rel, digest)
+    return manifest
+
+
+class AssetManifest:
+    def __init__(self, app=None, url_prefix='/assets'):
+        self.url_prefix = url_prefix
+        self.folder = None
+        self.urls = {}    # static path -> fingerprinted path
+        self.files = {}   # fingerprinted path -> static path
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.folder = app.static_folder
+        self.urls = build_manifest(self.folder) if os.path.isdir(self.folder) else {}
+        self.files = {hashed: rel for rel, hashed in self.urls.items()}
+        app.add_url_rule(self.url_prefix + '/<path:filename>', 'asset', self.serve)
+        app.add_template_global(self.url, 'asset_url')
+
+    def url(self, filename):
+        """URL for a static file, fingerprinted when it is in the manifest."""
+        if filename in self.urls:
+            return flask.url_for('asset', filename=self.urls[filename])
+        return flask.url_for('static', filename=filename)
+
+    def serve(self, filename):
+        if filename not in self.files:
+            flask.abort(404)
+        response = flask.send_from_directory(self.folder, self.files[filename])
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
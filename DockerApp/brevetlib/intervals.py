@@ -0,0 +1,123 @@
+"""
+"Which controls are open at time t?" across all brevets.
+
+IntervalIndex is a centered interval tree answering stabbing queries
+in O(log n + k).  OpenControls keeps one tree per brevet and rebuilds
+only the brevets whose version (see store.bump_version) changed since
+it last looked, so a submit costs one brevet's rebuild, not all of them.
+"""
+import threading
+import time
+from datetime import datetime
+from brevetlib import store
+
+OPEN_FIELDS = ('brevet_id',) + store.CONTROL_FIELDS
+
+
+class _Node:
+    __slots__ = ('center', 'by_start', 'by_end', 'left', 'right')
+
+
+class IntervalIndex:
+    """
+    Static index over closed intervals (start, end, item).  query(t)
+    returns the items whose interval contains t.
+    """
+
+    def __init__(self, intervals):
+        self.size = len(intervals)
+        self._root = self._build(list(intervals))
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+        points = sorted(point for start, end, _ in intervals for point in (start, end))
+        node = _Node()
+        node.center = points[len(points) // 2]
+        here, left, right = [], [], []
+        for interval in intervals:
+            if interval[1] < node.center:
+                left.append(interval)
+            elif interval[0] > node.center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        # Intervals containing the center, by start and by (descending) end
+        node.by_start = sorted(here, key=lambda interval: interval[0])
+        node.by_end = sorted(here, key=lambda interval: interval[1], reverse=True)
+        node.left = self._build(left)
+        node.right = self._build(right)
+        return node
+
+    def query(self, t):
+        found = []
+        node = self._root
+        while node is not None:
+            if t < node.center:
+                for start, _, item in node.by_start:
+                    if start > t:
+                        break
+                    found.append(item)
+                node = node.left
+            elif t > node.center:
+                for _, end, item in node.by_end:
+                    if end < t:
+                        break
+                    found.append(item)
+                node = node.right
+            else:
+                found.extend(item for _, _, item in node.by_start)
+                break
+        return found
+
+    def __len__(self):
+        return self.size
+
+
+class OpenControls:
+    """
+    Per-process index of every control's open window.  refresh() is
+    cheap (one small read of the version collection) and is throttled
+    to once every refresh_interval seconds.
+    """
+
+    def __init__(self, refresh_interval=1.0):
+        self.refresh_interval = refresh_interval
+        self._trees = {}      # brevet_id -> IntervalIndex
+        self._versions = {}   # brevet_id -> version the tree was built from
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self, brevet_id):
+        intervals = []
+        for ctrl in store.find_controls(OPEN_FIELDS, brevet_id=brevet_id):
+            opens, closes = ctrl.get('open_time'), ctrl.get('close_time')
+            # Controls saved with string times by older versions are skipped
+            if isinstance(opens, datetime) and isinstance(closes, datetime):
+                intervals.append((opens, closes, ctrl))
+        return IntervalIndex(intervals)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.refresh_interval:
+            return
+        with self._lock:
+            self._checked = now
+            versions = store.brevet_versions()
+            for brevet_id, version in versions.items():
+                if self._versions.get(brevet_id) != version:
+                    self._trees[brevet_id] = self._load(brevet_id)
+                    self._versions[brevet_id] = version
+            for brevet_id in set(self._trees) - set(versions):
+                del self._trees[brevet_id]
+                del self._versions[brevet_id]
+
+    def open_at(self, t):
+        """Controls open at t (a naive UTC datetime), in control_km order per brevet."""
+        self.refresh()
+        trees = dict(self._trees)   # refresh() may replace trees meanwhile
+        found = []
+        for brevet_id in sorted(trees):
+            found.extend(sorted(trees[brevet_id].query(t),
+                                key=lambda ctrl: ctrl['control_km']))
+        return found
@@ -0,0 +1,90 @@
+"""
+The listAll / listOpenOnly / listCloseOnly queries shared by brevet_api
+and brevet_ui, and their JSON and CSV encodings.
+"""
+from datetime import datetime, timezone
+from brevetlib import store
+
+# Which control fields each list query returns
+LIST_FIELDS = {
+    'listAll': ('open_time', 'close_time'),
+    'listOpenOnly': ('open_time',),
+    'listCloseOnly': ('close_time',),
+}
+RESULT_FORMATS = ('json', 'csv')
+
+
+class QueryError(ValueError):
+    """A list query that cannot be answered; str(err) is the message
+    the services return to the client."""
+
+
+def parse_top(top):
+    """
+    Returns the number of controls requested by the 'top' query
+    argument, or 0 (no limit) when it is missing or empty.
+    """
+    if (top is None) or (top == ''):
+        return 0
+    try:
+        limit = int(top)
+    except ValueError:
+        raise QueryError('Value Error for top')
+    if limit <= 0:
+        raise QueryError('Invalid number of top elements')
+    return limit
+
+
+def encode_value(value):
+    """
+    Control times are stored as dates, which Mongo hands back as naive
+    UTC datetimes; they are output as ISO 8601 strings.  Anything else
+    (including times stored as strings by older versions) is unchanged.
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return value
+
+
+def encode_controls(controls, resultFormat, fields, line_break='\n'):
+    '''
+      Input:
+        controls - iterable of control dicts holding (at least) fields
+        resultFormat - 'json' or 'csv'
+        fields - the control fields to output -- 'open_time'/'close_time'/etc.
+        line_break - CSV line separator ('<br>' when the CSV is shown as HTML)
+      Output:
+        json - a list of dictionaries of control info
+        csv - a string with a header line and one line per control
+    '''
+    if resultFormat == 'json':
+        return [{key: encode_value(ctrl[key]) for key in fields} for ctrl in controls]
+    lines = [', '.join(fields)]
+    lines.extend(', '.join(str(encode_value(ctrl[key])) for key in fields) for ctrl in controls)
+    lines.append('')
+    return line_break.join(lines)
+
+
+def list_controls(items, resultFormat, top=None, line_break='\n'):
+    """
+    Answer a list query: items is one of LIST_FIELDS, resultFormat one
+    of RESULT_FORMATS and top the raw 'top' query argument.  Raises
+    QueryError for an empty brevet or an invalid query.
+    """
+    if not store.has_controls():
+        raise QueryError('Empty Brevet')
+    fields, limit = parse_query(items, resultFormat, top)
+    controls = store.find_controls(fields, limit=limit)
+    return encode_controls(controls, resultFormat, fields, line_break)
+
+
+def parse_query(items, resultFormat, top):
+    """
+    Checks a list query and returns (fields to list, limit); raises
+    QueryError for an unknown list or format, or an invalid top.
+    """
+    if (items not in LIST_FIELDS) or (resultFormat not in RESULT_FORMATS):
+        raise QueryError('Invalid Query')
+    return LIST_FIELDS[items], parse_top(top)
@@ -0,0 +1,106 @@
+"""
+Compact in-memory model of controls and brevets.
+
+Control is a __slots__ record with validation, standing in for a stored
+control document where a page lists controls (see pages).  Brevet keeps
+a submitted brevet as parallel typed arrays -- control km, open and
+close offsets in minutes from the start -- plus the locations, instead
+of one object per control, and builds the documents to store straight
+from them.
+"""
+from array import array
+from datetime import timedelta, timezone
+from brevetlib import store
+
+
+def _control_km(control_km):
+    """control_km as a float; raises ValueError if it is not a distance."""
+    control_km = float(control_km)
+    if (control_km != control_km) or control_km < 0:   # NaN or negative
+        raise ValueError('Invalid control distance: {}'.format(control_km))
+    return control_km
+
+
+def _check_window(control_km, opens, closes):
+    if (opens is not None) and (closes is not None) and closes < opens:
+        raise ValueError('Control at {}km closes before it opens'.format(control_km))
+
+
+class Control:
+    """One control: field names match the stored document."""
+    __slots__ = ('control_km', 'control_location', 'open_time', 'close_time', 'brevet_id')
+
+    def __init__(self, control_km, control_location='', open_time=None, close_time=None,
+                 brevet_id=store.DEFAULT_BREVET_ID):
+        control_km = _control_km(control_km)
+        _check_window(control_km, open_time, close_time)
+        self.control_km = control_km
+        self.control_location = str(control_location or '')
+        self.open_time = open_time
+        self.close_time = close_time
+        self.brevet_id = brevet_id
+
+    def __getitem__(self, field):
+        # Lets a Control stand in for a document (templates, encode_controls)
+        return getattr(self, field)
+
+    def __repr__(self):
+        return 'Control({!r}, {!r}, {!r}, {!r})'.format(
+            self.control_km, self.control_location, self.open_time, self.close_time)
+
+
+def _as_utc(value):
+    """Mongo hands dates back naive; they are UTC."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class Brevet:
+    """
+    A whole brevet: start time plus parallel arrays, kept in control_km
+    order.  Offsets are whole minutes, as acp_times computes them.
+    """
+    __slots__ = ('brevet_id', 'brevet_dist_km', 'start', 'kms', 'open_offsets',
+                 'close_offsets', 'locations')
+
+    def __init__(self, start, brevet_dist_km=None, brevet_id=store.DEFAULT_BREVET_ID):
+        self.brevet_id = brevet_id
+        self.brevet_dist_km = brevet_dist_km
+        self.start = _as_utc(start)
+        self.kms = array('d')
+        self.open_offsets = array('l')
+        self.close_offsets = array('l')
+        self.locations = []
+
+    def add(self, control_km, location, open_offset, close_offset):
+        """Adds a control (validated like Control); keeps control_km order."""
+        control_km = _control_km(control_km)
+        _check_window(control_km, open_offset, close_offset)
+        i = len(self.kms)
+        while i > 0 and self.kms[i - 1] > control_km:
+            i -= 1
+        self.kms.insert(i, control_km)
+        self.open_offsets.insert(i, int(open_offset))
+        self.close_offsets.insert(i, int(close_offset))
+        self.locations.insert(i, str(location or ''))
+
+    def __len__(self):
+        return len(self.kms)
+
+    def open_time(self, i):
+        return self.start + timedelta(minutes=self.open_offsets[i])
+
+    def close_time(self, i):
+        return self.start + timedelta(minutes=self.close_offsets[i])
+
+    def to_bson(self):
+        """Documents for store.replace_controls, one per control."""
+        return [{'control_km': self.kms[i],
+                 'control_location': self.locations[i],
+                 'open_time': self.open_time(i),
+                 'close_time': self.close_time(i),
+                 'brevet_id': self.brevet_id,
+                 'brevet_start': self.start,
+                 'brevet_dist_km': self.brevet_dist_km}
+                for i in range(len(self))]
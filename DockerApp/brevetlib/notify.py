@@ -0,0 +1,70 @@
+"""
+In-process fan-out of brevet changes.
+
+One BrevetNotifier per process polls the brevet_versions collection
+(see store.bump_version) on a background thread and hands a compact
+event -- {'brevet_id': ..., 'version': ...} -- to every subscriber, so
+any number of open event streams cost a single watcher.
+"""
+import logging
+import queue
+import threading
+from pymongo.errors import PyMongoError
+from brevetlib import store
+
+log = logging.getLogger(__name__)
+
+
+class BrevetNotifier:
+    def __init__(self, poll_interval=1.0, queue_size=16):
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._versions = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self):
+        """Returns a queue that receives change events; starts the watcher."""
+        events = queue.Queue(self.queue_size)
+        with self._lock:
+            self._subscribers.add(events)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._watch, name='brevet-notifier',
+                                                daemon=True)
+                self._thread.start()
+        return events
+
+    def unsubscribe(self, events):
+        with self._lock:
+            self._subscribers.discard(events)
+
+    def versions(self):
+        """The versions as last seen by the watcher ({} before the first poll)."""
+        return dict(self._versions or {})
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for events in subscribers:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                pass   # A slow reader still has unread events telling it to refresh
+
+    def poll(self):
+        """Compares versions with the last poll and publishes the differences."""
+        versions = store.brevet_versions()
+        if self._versions is not None:
+            for brevet_id, version in versions.items():
+                if self._versions.get(brevet_id) != version:
+                    self.publish({'brevet_id': brevet_id, 'version': version})
+        self._versions = versions
+
+    def _watch(self):
+        stopped = threading.Event()
+        while not stopped.wait(self.poll_interval):
+            try:
+                self.poll()
+            except PyMongoError as err:
+                log.warning("Brevet notifier poll failed: %s", err)
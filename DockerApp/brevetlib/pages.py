@@ -0,0 +1,84 @@
+"""
+Paged, cached listing of a brevet's controls for server-rendered pages.
+
+ControlPage reads one page of controls from a projected, sorted cursor
+as the template iterates over it, so a page never exists as a list.
+PageCache keeps rendered pages keyed by brevet version and page number:
+a page streams to the client while it is rendered the first time, and
+is served from memory until the brevet changes.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from brevetlib import store
+from brevetlib.model import Control, _as_utc
+
+
+class ControlPage:
+    """
+    Page number (from 1) of size controls of brevet_id, in control_km
+    order.  has_next is known once the page has been iterated.
+    """
+    def __init__(self, number, size, brevet_id=store.DEFAULT_BREVET_ID):
+        self.number = number
+        self.size = size
+        self.brevet_id = brevet_id
+        self.has_next = False
+
+    def __iter__(self):
+        # One control more than the page tells whether there is a next page
+        cursor = store.find_controls(store.CONTROL_FIELDS, limit=self.size + 1,
+                                     brevet_id=self.brevet_id,
+                                     skip=(self.number - 1) * self.size)
+        for i, doc in enumerate(cursor):
+            if i == self.size:
+                self.has_next = True
+                break
+            yield Control(doc['control_km'], doc.get('control_location', ''),
+                          _utc(doc.get('open_time')), _utc(doc.get('close_time')),
+                          self.brevet_id)
+
+
+def _utc(value):
+    return _as_utc(value) if isinstance(value, datetime) else value
+
+
+class PageCache:
+    """
+    Rendered pages by (brevet_id, version, page).  Pages of older
+    versions are dropped when a newer one is stored; at most max_pages
+    are kept, least recently used first out.
+    """
+    def __init__(self, max_pages=64):
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The rendered page for key, or None."""
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+            return page
+
+    def put(self, key, page):
+        brevet_id, version = key[0], key[1]
+        with self._lock:
+            for old in [k for k in self._pages if k[0] == brevet_id and k[1] < version]:
+                del self._pages[old]
+            self._pages[key] = page
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+
+    def caching(self, key, chunks):
+        """
+        Passes the chunks of a page being rendered through, and stores
+        the page once all of it has been produced (not if the client
+        goes away first).
+        """
+        rendered = []
+        for chunk in chunks:
+            rendered.append(chunk)
+            yield chunk
+        self.put(key, ''.join(rendered))
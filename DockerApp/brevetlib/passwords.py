@@ -0,0 +1,19 @@
+"""
+Password hashing for the services that register and log in users.
+
+passlib is imported on first use: most requests never hash a password,
+and flask_app, which never does, does not install it.  Both functions
+are plain module functions so that they can run in a process pool
+(bulk_users, api_async).
+"""
+
+
+def hash_password(password):
+    from passlib.apps import custom_app_context as pwd_context
+    return pwd_context.encrypt(password)
+
+
+def verify_password(password, password_hash):
+    """True if password is the one password_hash was made from."""
+    from passlib.apps import custom_app_context as pwd_context
+    return pwd_context.verify(password, password_hash)
@@ -0,0 +1,101 @@
+"""
+Startup bootstrap: indexes and schema version.
+
+ensure_schema() is called by every service when it starts.  It is
+idempotent and safe to run from several processes at once: indexes are
+created only if missing, migrations only touch documents that still
+need them, and the recorded version only moves forward.
+
+The version is kept in the 'meta' collection of brevetdb as
+{'_id': 'schema', 'version': N}.  To change the document layout, add a
+migration to MIGRATIONS under the next version number.
+"""
+import logging
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError, OperationFailure
+from brevetlib import store
+
+log = logging.getLogger(__name__)
+
+META_COLLECTION = 'meta'
+SCHEMA_DOC_ID = 'schema'
+MIGRATION_BATCH = 500   # documents updated per round trip
+
+# (collection getter, keys, options) -- names are left to Mongo's defaults
+INDEXES = [
+    (store.user_collection, [('username', ASCENDING)], {'unique': True}),
+    (store.brevet_collection, [('control_km', ASCENDING)], {}),
+    (store.brevet_collection, [('brevet_id', ASCENDING), ('control_km', ASCENDING)], {}),
+    (store.brevet_collection, [('open_time', ASCENDING)], {}),
+    (store.brevet_collection, [('close_time', ASCENDING)], {}),
+    (store.submission_collection, [('updated', ASCENDING)],
+     {'expireAfterSeconds': store.SUBMISSION_TTL}),
+]
+
+
+def meta_collection():
+    return store.get_client()[store.BREVET_DB][META_COLLECTION]
+
+
+def migrate_in_batches(collection, query, update, batch=MIGRATION_BATCH):
+    """
+    Apply update to every document matching query, batch documents at a
+    time.  query must stop matching a document once it is updated.
+    Returns the number of documents changed.
+    """
+    changed = 0
+    while True:
+        ids = [doc['_id'] for doc in collection.find(query, {'_id': 1}, limit=batch)]
+        if not ids:
+            return changed
+        changed += collection.update_many({'_id': {'$in': ids}}, update).modified_count
+
+
+def _add_brevet_id():
+    """Version 1: every control belongs to a brevet (see store.DEFAULT_BREVET_ID)."""
+    return migrate_in_batches(store.brevet_collection(),
+                              {'brevet_id': {'$exists': False}},
+                              {'$set': {'brevet_id': store.DEFAULT_BREVET_ID}})
+
+
+# version -> migration bringing documents from version - 1 up to it
+MIGRATIONS = {
+    1: _add_brevet_id,
+}
+SCHEMA_VERSION = max(MIGRATIONS)
+
+
+def schema_version():
+    doc = meta_collection().find_one({'_id': SCHEMA_DOC_ID})
+    return doc['version'] if doc else 0
+
+
+def ensure_indexes():
+    for collection, keys, options in INDEXES:
+        try:
+            collection().create_index(keys, **options)
+        except OperationFailure as err:
+            # e.g. duplicate usernames already stored; keep serving
+            log.error("Could not create index %s: %s", keys, err)
+
+
+def ensure_schema():
+    """
+    Create missing indexes and run pending migrations.  Returns True on
+    success and False if the database could not be reached, so a
+    service can still start (and retry on its next start).
+    """
+    try:
+        ensure_indexes()
+        current = schema_version()
+        for version in sorted(MIGRATIONS):
+            if version <= current:
+                continue
+            changed = MIGRATIONS[version]()
+            log.info("Schema migrated to version %s (%s documents)", version, changed)
+            meta_collection().update_one({'_id': SCHEMA_DOC_ID},
+                                         {'$max': {'version': version}}, upsert=True)
+        return True
+    except PyMongoError as err:
+        log.error("Schema bootstrap failed: %s", err)
+        return False
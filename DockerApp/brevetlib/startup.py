@@ -0,0 +1,51 @@
+"""
+Keeping service start-up cheap.
+
+Importing a service should not touch Mongo or compile templates: a
+gunicorn worker that is recycled, or a container that starts before
+Mongo is up, would otherwise wait on them.  defer_schema runs
+ensure_schema on the first request instead of at import (and retries
+it while Mongo is down), and cache_templates keeps compiled Jinja
+templates on disk so a new process loads them instead of compiling
+them again.
+"""
+import os
+import threading
+import time
+from jinja2 import FileSystemBytecodeCache
+from brevetlib.schema import ensure_schema
+
+
+def defer_schema(app, retry_after=30):
+    """
+    Runs ensure_schema before app's first request, and again (at most
+    every retry_after seconds) until it succeeds: a worker that starts
+    before Mongo is up still gets its indexes and migrations.
+    """
+    lock = threading.Lock()
+    done = False
+    next_try = 0.0
+
+    @app.before_request
+    def _ensure_schema():
+        nonlocal done, next_try
+        if done or time.monotonic() < next_try:
+            return
+        with lock:
+            if done or time.monotonic() < next_try:
+                return
+            if ensure_schema():
+                done = True
+            else:
+                next_try = time.monotonic() + retry_after
+
+
+def cache_templates(app, directory=None):
+    """
+    Keeps app's compiled templates in directory (default $JINJA_CACHE_DIR,
+    else a per-user directory under the system temp directory).
+    """
+    directory = directory or os.environ.get('JINJA_CACHE_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
@@ -0,0 +1,190 @@
+"""
+Mongo client and collection access for the brevet services.
+
+The client is created on first use from MONGO_URI (default: the
+'mongo' host from docker-compose.yml) and shared by every caller in the
+process.  All queries the services make go through the functions here.
+"""
+import os
+import threading
+from datetime import datetime
+from pymongo import MongoClient, ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+DEFAULT_MONGO_URI = 'mongodb://mongo:27017/'
+BREVET_DB = 'brevetdb'
+BREVET_COLLECTION = 'brevet'
+VERSION_COLLECTION = 'brevet_versions'   # {'_id': brevet_id, 'version': n}
+# Write-behind submissions: {'_id': id, 'status', 'detail', 'updated'}
+SUBMISSION_COLLECTION = 'brevet_submissions'
+SUBMISSION_TTL = 24 * 60 * 60   # seconds a submission's status is kept
+USERS_DB = 'usersdb'
+USER_COLLECTION = 'UserInfo'
+
+# Controls are stored one document per control, tagged with the brevet
+# they belong to.  The services keep a single current brevet.
+DEFAULT_BREVET_ID = 'default'
+
+# Every field of a stored control, in display order
+CONTROL_FIELDS = ('control_km', 'control_location', 'open_time', 'close_time')
+CONTROL_ORDER = [('control_km', ASCENDING)]
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the process-wide MongoClient, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # connect=False: nothing is sent until the first operation
+                _client = MongoClient(os.environ.get('MONGO_URI', DEFAULT_MONGO_URI),
+                                      connect=False)
+    return _client
+
+
+def brevet_collection():
+    return get_client()[BREVET_DB][BREVET_COLLECTION]
+
+
+def version_collection():
+    return get_client()[BREVET_DB][VERSION_COLLECTION]
+
+
+def submission_collection():
+    return get_client()[BREVET_DB][SUBMISSION_COLLECTION]
+
+
+def user_collection():
+    return get_client()[USERS_DB][USER_COLLECTION]
+
+
+def projection(fields):
+    """Mongo projection returning only fields (and not _id)."""
+    proj = {field: 1 for field in fields}
+    proj['_id'] = 0
+    return proj
+
+
+###
+# Controls
+###
+
+def has_controls():
+    """True if the brevet has at least one control (cheaper than a count)."""
+    return brevet_collection().find_one({}, {'_id': 1}) is not None
+
+
+def find_controls(fields=CONTROL_FIELDS, limit=0, brevet_id=None, skip=0):
+    """
+    Returns a cursor over the controls (of one brevet, if brevet_id is
+    given) in control_km order, each a dict holding only the requested
+    fields.  limit=0 means all; skip passes over the first controls.
+    """
+    query = {} if brevet_id is None else {'brevet_id': brevet_id}
+    return brevet_collection().find(query, projection(fields),
+                                    sort=CONTROL_ORDER, limit=limit, skip=skip)
+
+
+def clear_controls(brevet_id=DEFAULT_BREVET_ID):
+    replace_controls([], brevet_id)
+
+
+def replace_controls(controls, brevet_id=DEFAULT_BREVET_ID, write_concern=None):
+    """
+    Replace the stored brevet with controls (a list of control dicts)
+    and return its new version.  write_concern (a pymongo WriteConcern)
+    overrides the client's default for these writes.  Clearing a brevet
+    that is already empty writes nothing and keeps its version, so
+    readers caching by version (and event subscribers) see no change.
+    """
+    collection = brevet_collection()
+    if not controls and collection.find_one({'brevet_id': brevet_id}, {'_id': 1}) is None:
+        return brevet_version(brevet_id)
+    if write_concern is not None:
+        collection = collection.with_options(write_concern=write_concern)
+    collection.delete_many({'brevet_id': brevet_id})
+    if controls:
+        for ctrl in controls:
+            ctrl['brevet_id'] = brevet_id
+        collection.insert_many(controls)
+    return bump_version(brevet_id)
+
+
+###
+# Versions
+#   Every write to a brevet bumps its version, so readers in other
+#   processes can tell cheaply whether what they hold is stale.
+###
+
+def bump_version(brevet_id):
+    """Increments and returns the version of brevet_id."""
+    doc = version_collection().find_one_and_update(
+        {'_id': brevet_id}, {'$inc': {'version': 1}},
+        upsert=True, return_document=ReturnDocument.AFTER)
+    return doc['version']
+
+
+def brevet_version(brevet_id):
+    """The current version of brevet_id (0 if it was never written)."""
+    doc = version_collection().find_one({'_id': brevet_id})
+    return doc['version'] if doc else 0
+
+
+def brevet_versions():
+    """Returns {brevet_id: version} for every brevet ever written."""
+    return {doc['_id']: doc['version'] for doc in version_collection().find()}
+
+
+###
+# Write-behind submissions
+#   Outcomes are kept in Mongo so that any worker can answer a poll for
+#   a submission queued by another; a TTL index (see schema) expires them.
+###
+
+def set_submission_status(submissions, status, detail=None):
+    """Records status (and detail) for every id in submissions."""
+    fields = {'status': status, 'detail': detail, 'updated': datetime.utcnow()}
+    # Usually one id: submissions for a brevet are coalesced per batch
+    for submission in submissions:
+        submission_collection().update_one({'_id': submission}, {'$set': fields}, upsert=True)
+
+
+def submission_status(submission):
+    """Returns (status, detail) of submission, or None if it is not known."""
+    doc = submission_collection().find_one({'_id': submission})
+    return (doc['status'], doc['detail']) if doc else None
+
+
+###
+# Users
+###
+
+def find_user(username):
+    """Returns the user document for username, or None."""
+    return user_collection().find_one({'username': username})
+
+
+def add_user(username, password_hash):
+    """Stores a new user and returns its id."""
+    result = user_collection().insert_one({'username': username, 'password': password_hash})
+    return result.inserted_id
+
+
+def add_users(users):
+    """
+    Stores many users (dicts with username and password hash) in one
+    unordered insert, so one bad row does not stop the rest.  Returns
+    (number inserted, {index in users: Mongo error code}); duplicate
+    usernames are reported by the unique index with code 11000.
+    """
+    if not users:
+        return 0, {}
+    try:
+        result = user_collection().insert_many(users, ordered=False)
+        return len(result.inserted_ids), {}
+    except BulkWriteError as err:
+        failed = {error['index']: error['code'] for error in err.details['writeErrors']}
+        return err.details['nInserted'], failed
@@ -0,0 +1,70 @@
+"""
+Per-brevet totals computed in Mongo.
+
+summarize() runs one aggregation pipeline for the brevets it is asked
+about -- control count, farthest control, earliest open and latest
+close -- so clients no longer download every control to get a handful
+of numbers.  Results are cached per brevet version (see
+store.bump_version): a brevet is only aggregated again after it changes.
+"""
+import threading
+from brevetlib import store
+from brevetlib.listing import encode_value
+
+SUMMARY_FIELDS = ('controls', 'max_km', 'earliest_open', 'latest_close')
+
+
+def aggregate(brevet_ids):
+    """Runs the pipeline for brevet_ids; returns {brevet_id: summary}."""
+    pipeline = [
+        {'$match': {'brevet_id': {'$in': list(brevet_ids)}}},
+        {'$group': {
+            '_id': '$brevet_id',
+            'controls': {'$sum': 1},
+            'max_km': {'$max': '$control_km'},
+            'earliest_open': {'$min': '$open_time'},
+            'latest_close': {'$max': '$close_time'}
+        }}
+    ]
+    found = {}
+    for doc in store.brevet_collection().aggregate(pipeline):
+        found[doc['_id']] = {field: doc.get(field) for field in SUMMARY_FIELDS}
+    return found
+
+
+def empty_summary():
+    return {'controls': 0, 'max_km': None, 'earliest_open': None, 'latest_close': None}
+
+
+class SummaryCache:
+    def __init__(self):
+        self._cache = {}   # brevet_id -> (version, summary)
+        self._lock = threading.Lock()
+
+    def summarize(self, brevet_id=None):
+        """
+        Summaries (JSON ready) of brevet_id, or of every brevet if it is
+        None, in brevet_id order.  Unknown brevets give an empty list.
+        """
+        versions = store.brevet_versions()
+        if brevet_id is not None:
+            versions = {brevet_id: versions[brevet_id]} if brevet_id in versions else {}
+        with self._lock:
+            cached = dict(self._cache)
+        stale = [bid for bid, version in versions.items()
+                 if cached.get(bid, (None,))[0] != version]
+        if stale:
+            fresh = aggregate(stale)
+            for bid in stale:
+                cached[bid] = (versions[bid], fresh.get(bid, empty_summary()))
+            with self._lock:
+                for bid in stale:
+                    self._cache[bid] = cached[bid]
+
+        result = []
+        for bid in sorted(versions):
+            version, summary = cached[bid]
+            entry = {'brevet_id': bid, 'version': version}
+            entry.update({field: encode_value(summary[field]) for field in SUMMARY_FIELDS})
+            result.append(entry)
+        return result
@@ -0,0 +1,61 @@
+"""
+Nose tests for brevetlib.applog
+"""
+import io
+import json
+import logging
+from brevetlib import applog
+
+
+def test_parse_sampling():
+	''' app.ini spells sampling rates as name=rate pairs '''
+	assert applog.parse_sampling('werkzeug=0.1, flask_app=1') == {'werkzeug': 0.1, 'flask_app': 1.0}
+	assert applog.parse_sampling(None) == {}
+
+
+def test_sampling_uses_longest_prefix():
+	''' A rate set for a parent logger governs its children '''
+	sampler = applog.SamplingFilter({'werkzeug': 0.0, 'werkzeug.keep': 1.0})
+	assert sampler.rate_for('werkzeug.serving') == 0.0
+	assert sampler.rate_for('werkzeug.keep.me') == 1.0
+	assert sampler.rate_for('flask_app') == 1.0
+
+
+def test_sampling_keeps_warnings():
+	''' Sampling never drops warnings or errors '''
+	sampler = applog.SamplingFilter({'noisy': 0.0})
+	info = logging.makeLogRecord({'name': 'noisy', 'levelno': logging.INFO})
+	warning = logging.makeLogRecord({'name': 'noisy', 'levelno': logging.WARNING})
+	assert not sampler.filter(info)
+	assert sampler.filter(warning)
+
+
+def test_queued_json_output():
+	''' Records are written as JSON lines once the listener drains the queue '''
+	out = io.StringIO()
+	applog.configure_logging(level=logging.INFO, sampling='noisy=0', stream=out)
+	try:
+		logging.getLogger('test').info('hello %s', 'world')
+		logging.getLogger('test').debug('not enabled %s', 'at all')
+		logging.getLogger('noisy').info('sampled out')
+	finally:
+		applog._stop_logging()
+	lines = [json.loads(line) for line in out.getvalue().splitlines()]
+	assert [line['msg'] for line in lines] == ['hello world']
+	assert lines[0]['level'] == 'INFO' and lines[0]['logger'] == 'test'
+
+
+def test_configure_from_env():
+	''' Services without an app.ini take the level and sampling from the environment '''
+	import os
+	os.environ.update(LOG_LEVEL='warning', LOG_SAMPLING='noisy=0.5')
+	try:
+		listener = applog.configure_from_env()
+		assert logging.getLogger().level == logging.WARNING
+		assert listener is not None
+		sampler = logging.getLogger().handlers[0].filters[0]
+		assert sampler.rates == {'noisy': 0.5}
+	finally:
+		applog._stop_logging()
+		del os.environ['LOG_LEVEL'], os.environ['LOG_SAMPLING']
+		logging.getLogger().setLevel(logging.INFO)
@@ -0,0 +1,43 @@
+"""
+Nose tests for brevetlib.assets
+"""
+import os
+import tempfile
+import flask
+from brevetlib import assets
+
+
+def make_app(folder):
+	app = flask.Flask(__name__, static_folder=folder, static_url_path='/static')
+	return app, assets.AssetManifest(app)
+
+
+def test_fingerprinted_url_is_immutable():
+	''' Assets are served at a content-hashed URL with immutable caching '''
+	folder = tempfile.mkdtemp()
+	os.makedirs(os.path.join(folder, 'js'))
+	with open(os.path.join(folder, 'js', 'app.js'), 'w') as asset:
+		asset.write('var x = 1;')
+	app, manifest = make_app(folder)
+	with app.test_request_context():
+		url = manifest.url('js/app.js')
+		assert url.startswith('/assets/js/app.') and url.endswith('.js')
+		assert manifest.url('missing.css') == '/static/missing.css'
+	response = app.test_client().get(url)
+	assert response.status_code == 200
+	assert response.get_data(as_text=True) == 'var x = 1;'
+	assert 'immutable' in response.headers['Cache-Control']
+	response.close()
+	assert app.test_client().get('/assets/js/app.0000.js').status_code == 404
+
+
+def test_changed_content_changes_url():
+	''' Editing a file gives it a new fingerprint '''
+	folder = tempfile.mkdtemp()
+	path = os.path.join(folder, 'calc.css')
+	with open(path, 'w') as asset:
+		asset.write('body {}')
+	before = assets.build_manifest(folder)['calc.css']
+	with open(path, 'w') as asset:
+		asset.write('body { color: red; }')
+	assert assets.build_manifest(folder)['calc.css'] != before
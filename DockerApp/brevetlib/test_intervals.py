@@ -0,0 +1,58 @@
+"""
+Nose tests for brevetlib.intervals
+"""
+import random
+from datetime import datetime, timedelta
+import mongomock
+from brevetlib import store
+from brevetlib.intervals import IntervalIndex, OpenControls
+
+START = datetime(2018, 6, 1, 6, 0)
+
+
+def test_interval_index_matches_brute_force():
+	''' Stabbing queries agree with checking every interval, endpoints included '''
+	rng = random.Random(322)
+	intervals = []
+	for i in range(300):
+		start = rng.randint(0, 1000)
+		intervals.append((start, start + rng.randint(0, 200), i))
+	index = IntervalIndex(intervals)
+	for t in list(range(-5, 1250, 7)) + [intervals[0][0], intervals[0][1]]:
+		expected = sorted(item for start, end, item in intervals if start <= t <= end)
+		assert sorted(index.query(t)) == expected
+
+
+def test_empty_index():
+	assert IntervalIndex([]).query(5) == []
+
+
+def test_open_controls_follows_brevet_versions():
+	''' Only brevets whose version changed are reloaded, and removed ones drop out '''
+	store._client = mongomock.MongoClient()
+	index = OpenControls(refresh_interval=0)
+	store.replace_controls([{'control_km': 0, 'control_location': 'Start',
+		'open_time': START, 'close_time': START + timedelta(hours=1)}], brevet_id='a')
+	store.replace_controls([{'control_km': 100, 'control_location': 'Mid',
+		'open_time': START + timedelta(hours=3), 'close_time': START + timedelta(hours=7)}], brevet_id='b')
+	assert [c['brevet_id'] for c in index.open_at(START + timedelta(minutes=30))] == ['a']
+	assert [c['brevet_id'] for c in index.open_at(START + timedelta(hours=4))] == ['b']
+
+	# Count which brevets are read back from the store from here on
+	loaded = []
+	find_controls = store.find_controls
+	def counting_find_controls(*args, **kwargs):
+		loaded.append(kwargs.get('brevet_id'))
+		return find_controls(*args, **kwargs)
+	store.find_controls = counting_find_controls
+	try:
+		store.replace_controls([{'control_km': 100, 'control_location': 'Mid',
+			'open_time': START + timedelta(hours=5), 'close_time': START + timedelta(hours=7)}], brevet_id='b')
+		assert index.open_at(START + timedelta(hours=4)) == []
+		assert [c['brevet_id'] for c in index.open_at(START + timedelta(minutes=30))] == ['a']
+		assert loaded == ['b']
+	finally:
+		store.find_controls = find_controls
+
+	store.clear_controls(brevet_id='b')
+	assert index.open_at(START + timedelta(hours=6)) == []
@@ -0,0 +1,44 @@
+"""
+Nose tests for brevetlib.listing (the parts that need no database)
+"""
+from datetime import datetime
+from brevetlib.listing import QueryError, parse_top, encode_controls
+
+CONTROLS = [
+	{'open_time': 'o1', 'close_time': 'c1'},
+	{'open_time': 'o2', 'close_time': 'c2'},
+]
+
+
+def test_encode_json():
+	''' JSON gives one dictionary per control holding only the requested fields '''
+	assert encode_controls(CONTROLS, 'json', ('open_time',)) == [{'open_time': 'o1'}, {'open_time': 'o2'}]
+
+
+def test_encode_csv_two_fields():
+	''' Header line, then one line per control '''
+	assert encode_controls(CONTROLS, 'csv', ('open_time', 'close_time')) == 'open_time, close_time\no1, c1\no2, c2\n'
+
+
+def test_encode_csv_html():
+	''' brevet_ui shows CSV inside HTML, so it separates lines with <br> '''
+	assert encode_controls(CONTROLS, 'csv', ('close_time',), line_break='<br>') == 'close_time<br>c1<br>c2<br>'
+
+
+def test_parse_top():
+	''' Missing top means no limit; non-positive or non-numeric tops are errors '''
+	assert parse_top(None) == 0
+	assert parse_top('') == 0
+	assert parse_top('3') == 3
+	for bad, message in [('0', 'Invalid number of top elements'), ('x', 'Value Error for top')]:
+		try:
+			parse_top(bad)
+			assert False, bad
+		except QueryError as err:
+			assert str(err) == message
+
+
+def test_encode_stored_dates():
+	''' Times stored as dates come back from Mongo as naive UTC and are output as ISO 8601 '''
+	stored = [{'open_time': datetime(2018, 1, 1, 5, 53)}]
+	assert encode_controls(stored, 'json', ('open_time',)) == [{'open_time': '2018-01-01T05:53:00+00:00'}]
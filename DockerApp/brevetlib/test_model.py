@@ -0,0 +1,63 @@
+"""
+Nose tests for brevetlib.model
+"""
+from datetime import datetime, timezone
+from brevetlib.listing import encode_controls
+from brevetlib.model import Control, Brevet
+
+START = datetime(2018, 6, 1, 6, 0, tzinfo=timezone.utc)
+
+
+def make_brevet():
+	brevet = Brevet(START, 200)
+	brevet.add(175, 'Mid', 309, 700)
+	brevet.add(0, 'Start', 0, 60)
+	return brevet
+
+
+def test_controls_kept_in_km_order():
+	brevet = make_brevet()
+	assert list(brevet.kms) == [0.0, 175.0]
+	assert brevet.locations == ['Start', 'Mid']
+	assert brevet.close_time(1) == datetime(2018, 6, 1, 17, 40, tzinfo=timezone.utc)
+
+
+def test_invalid_controls_rejected():
+	for args in [(-1, 'x'), ('abc', 'x'), (10, 'x', 60, 30)]:
+		try:
+			Control(*args)
+			assert False, args
+		except ValueError:
+			pass
+
+
+def test_invalid_brevet_controls_rejected():
+	brevet = Brevet(START, 200)
+	for args in [(-1, 'x', 0, 60), ('abc', 'x', 0, 60), (10, 'x', 60, 30)]:
+		try:
+			brevet.add(*args)
+			assert False, args
+		except ValueError:
+			pass
+	assert len(brevet) == 0
+
+
+def test_bson_documents():
+	''' One document per control, in km order, with times from the start '''
+	docs = make_brevet().to_bson()
+	assert [doc['control_km'] for doc in docs] == [0.0, 175.0]
+	assert docs[1] == {'control_km': 175.0, 'control_location': 'Mid',
+		'open_time': datetime(2018, 6, 1, 11, 9, tzinfo=timezone.utc),
+		'close_time': datetime(2018, 6, 1, 17, 40, tzinfo=timezone.utc),
+		'brevet_id': 'default', 'brevet_start': START, 'brevet_dist_km': 200}
+
+
+def test_controls_encode_like_documents():
+	''' Controls stand in for stored documents in encode_controls '''
+	fields = ('control_km', 'open_time', 'close_time')
+	brevet = make_brevet()
+	controls = [Control(brevet.kms[i], brevet.locations[i], brevet.open_time(i), brevet.close_time(i))
+		for i in range(len(brevet))]
+	rows = encode_controls(controls, 'json', fields)
+	assert rows[1] == {'control_km': 175.0, 'open_time': '2018-06-01T11:09:00+00:00',
+		'close_time': '2018-06-01T17:40:00+00:00'}
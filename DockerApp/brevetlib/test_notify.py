@@ -0,0 +1,29 @@
+"""
+Nose tests for brevetlib.notify
+"""
+import mongomock
+from brevetlib import store
+from brevetlib.notify import BrevetNotifier
+
+
+def test_changes_fan_out_to_subscribers():
+	''' Each subscriber gets one event per changed brevet; the first poll only records versions '''
+	store._client = mongomock.MongoClient()
+	notifier = BrevetNotifier(poll_interval=3600)
+	first, second = notifier.subscribe(), notifier.subscribe()
+	store.bump_version('a')
+	notifier.poll()
+	assert first.empty()
+
+	store.bump_version('a')
+	store.bump_version('b')
+	notifier.poll()
+	for events in (first, second):
+		got = sorted((e['brevet_id'], e['version']) for e in [events.get_nowait(), events.get_nowait()])
+		assert got == [('a', 2), ('b', 1)]
+		assert events.empty()
+
+	notifier.unsubscribe(second)
+	store.bump_version('a')
+	notifier.poll()
+	assert first.get_nowait()['version'] == 3 and second.empty()
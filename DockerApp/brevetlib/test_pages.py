@@ -0,0 +1,42 @@
+"""
+Nose tests for brevetlib.pages, run against mongomock
+"""
+from datetime import datetime, timedelta
+import mongomock
+from brevetlib import store, pages
+
+
+def setup_function(function=None):
+	store._client = mongomock.MongoClient()
+
+
+def store_controls(kms):
+	start = datetime(2018, 6, 1, 6)
+	store.replace_controls([{'control_km': km, 'control_location': 'c{}'.format(km),
+		'open_time': start, 'close_time': start + timedelta(hours=1)} for km in kms])
+
+
+def test_pages_in_km_order():
+	''' Pages are consecutive slices in control_km order; the last has no next '''
+	store_controls([30, 0, 20, 10, 40])
+	first = pages.ControlPage(1, 2)
+	assert [ctrl.control_km for ctrl in first] == [0, 10]
+	assert first.has_next
+	last = pages.ControlPage(3, 2)
+	controls = list(last)
+	assert [ctrl.control_km for ctrl in controls] == [40]
+	assert not last.has_next
+	assert controls[0].open_time.utcoffset() == timedelta(0)
+
+
+def test_cache_keeps_latest_version():
+	''' A page is stored once fully rendered; a new version drops older ones '''
+	cache = pages.PageCache(max_pages=2)
+	chunks = cache.caching(('b', 1, 1), iter(['<p>', 'x', '</p>']))
+	assert cache.get(('b', 1, 1)) is None
+	assert ''.join(chunks) == '<p>x</p>'
+	assert cache.get(('b', 1, 1)) == '<p>x</p>'
+	cache.put(('b', 1, 2), 'page 2')
+	cache.put(('b', 2, 1), 'new')
+	assert cache.get(('b', 1, 1)) is None and cache.get(('b', 1, 2)) is None
+	assert cache.get(('b', 2, 1)) == 'new'
@@ -0,0 +1,30 @@
+"""
+Nose tests for brevetlib.schema, run against mongomock
+"""
+import mongomock
+from brevetlib import store, schema
+
+
+def setup_function(function=None):
+	store._client = mongomock.MongoClient()
+
+
+def test_migration_backfills_in_batches():
+	''' Controls stored before versioning are tagged with the default brevet '''
+	store.brevet_collection().insert_many([{'control_km': km} for km in range(7)])
+	changed = schema.migrate_in_batches(store.brevet_collection(),
+		{'brevet_id': {'$exists': False}},
+		{'$set': {'brevet_id': store.DEFAULT_BREVET_ID}}, batch=3)
+	assert changed == 7
+	assert store.brevet_collection().count_documents({'brevet_id': store.DEFAULT_BREVET_ID}) == 7
+
+
+def test_ensure_schema_is_idempotent():
+	''' Running the bootstrap twice leaves one set of indexes and the latest version '''
+	assert schema.ensure_schema()
+	assert schema.ensure_schema()
+	assert schema.schema_version() == schema.SCHEMA_VERSION
+	users = store.user_collection().index_information()
+	assert users['username_1']['unique']
+	assert 'control_km_1' in store.brevet_collection().index_information()
+
@@ -0,0 +1,38 @@
+"""
+Nose tests for brevetlib.startup
+"""
+from brevetlib import startup
+
+
+class FakeApp():
+	def __init__(self):
+		self.hooks = []
+
+	def before_request(self, hook):
+		self.hooks.append(hook)
+		return hook
+
+
+def test_schema_retried_until_it_succeeds():
+	''' A failed bootstrap (Mongo down) is retried, throttled, and stops once it works '''
+	results = [False, False, True]
+	calls = []
+	ensure_schema = startup.ensure_schema
+	def fake_ensure_schema():
+		calls.append(True)
+		return results[len(calls) - 1]
+	startup.ensure_schema = fake_ensure_schema
+	try:
+		app = FakeApp()
+		startup.defer_schema(app, retry_after=0)
+		for _ in range(5):
+			app.hooks[0]()
+		assert len(calls) == 3
+		throttled = FakeApp()
+		calls.clear()
+		startup.defer_schema(throttled, retry_after=3600)
+		throttled.hooks[0]()
+		throttled.hooks[0]()
+		assert len(calls) == 1
+	finally:
+		startup.ensure_schema = ensure_schema
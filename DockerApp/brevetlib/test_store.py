@@ -0,0 +1,33 @@
+"""
+Nose tests for brevetlib.store, run against mongomock
+"""
+from datetime import datetime
+import mongomock
+from brevetlib import store, schema
+
+
+def setup_function(function=None):
+	store._client = mongomock.MongoClient()
+
+
+def test_clearing_empty_brevet_keeps_version():
+	''' Clearing an already empty brevet is not a change: no write, no new version '''
+	assert store.replace_controls([]) == 0
+	assert store.brevet_versions() == {}
+	start = datetime(2018, 6, 1, 6)
+	assert store.replace_controls([{'control_km': 0, 'open_time': start, 'close_time': start}]) == 1
+	assert store.replace_controls([]) == 2
+	assert store.replace_controls([]) == 2
+	store.clear_controls()
+	assert store.brevet_version(store.DEFAULT_BREVET_ID) == 2
+
+
+def test_add_users_reports_duplicate_rows():
+	''' One unordered insert keeps the new users and reports taken usernames by index '''
+	schema.ensure_schema()
+	store.add_user('taken', 'x')
+	users = [{'username': name, 'password': 'x'} for name in ('a', 'taken', 'b', 'a')]
+	inserted, failed = store.add_users(users)
+	assert inserted == 2
+	assert failed == {1: 11000, 3: 11000}
+	assert store.user_collection().count_documents({}) == 3
@@ -0,0 +1,38 @@
+"""
+Nose tests for brevetlib.summary
+"""
+from datetime import datetime
+import mongomock
+from brevetlib import store, summary
+from brevetlib.summary import SummaryCache
+
+START = datetime(2018, 6, 1, 6, 0)
+
+
+def control(km, opens, closes):
+	return {'control_km': km, 'control_location': '',
+		'open_time': START.replace(hour=opens), 'close_time': START.replace(hour=closes)}
+
+
+def test_summaries_cached_per_version():
+	store._client = mongomock.MongoClient()
+	store.replace_controls([control(0, 6, 7), control(150, 10, 16)], brevet_id='a')
+	store.replace_controls([control(50, 8, 9)], brevet_id='b')
+
+	calls = []
+	aggregate = summary.aggregate
+	summary.aggregate = lambda ids: calls.append(sorted(ids)) or aggregate(ids)
+	try:
+		cache = SummaryCache()
+		first = cache.summarize()
+		assert [(s['brevet_id'], s['controls'], s['max_km']) for s in first] == [('a', 2, 150), ('b', 1, 50)]
+		assert first[0]['earliest_open'] == '2018-06-01T06:00:00+00:00'
+		assert first[0]['latest_close'] == '2018-06-01T16:00:00+00:00'
+
+		assert cache.summarize() == first            # nothing changed: no aggregation
+		store.clear_controls(brevet_id='b')
+		assert cache.summarize('b')[0]['controls'] == 0
+		assert cache.summarize('missing') == []
+		assert calls == [['a', 'b'], ['b']]
+	finally:
+		summary.aggregate = aggregate
@@ -0,0 +1,95 @@
+"""
+Nose tests for brevetlib.writebehind
+"""
+import threading
+import mongomock
+from brevetlib import store, writebehind
+from brevetlib.writebehind import WriteBehindQueue, QueueFull, parse_write_concern
+
+
+def setup_function(function=None):
+	store._client = mongomock.MongoClient()
+
+
+def test_submissions_become_durable():
+	''' The newest submission for a brevet is what ends up stored '''
+	writer = WriteBehindQueue()
+	ids = [writer.submit([{'control_km': km}]) for km in (1, 2, 3)]
+	writer.flush()
+	assert all(writer.status(i)[0] == writebehind.DURABLE for i in ids)
+	assert [c['control_km'] for c in store.find_controls(('control_km',))] == [3]
+	assert writer.status('nope') == (writebehind.UNKNOWN, None)
+	writer.close()
+
+
+def test_status_is_shared_between_workers():
+	''' A worker answers for submissions another worker queued, through Mongo '''
+	release = threading.Event()
+	replace = store.replace_controls
+	def slow_replace(*args, **kwargs):
+		release.wait()
+		return replace(*args, **kwargs)
+	store.replace_controls = slow_replace
+	try:
+		writer, other = WriteBehindQueue(), WriteBehindQueue()
+		submission = writer.submit([{'control_km': 4}])
+		# Nothing is recorded in Mongo until the write; a recent id is pending
+		assert store.submission_status(submission) is None
+		assert other.status(submission) == (writebehind.PENDING, None)
+		release.set()
+		writer.flush()
+		assert other.status(submission) == writer.status(submission) == (writebehind.DURABLE, 1)
+		assert other.status('nope') == (writebehind.UNKNOWN, None)
+		assert other.status('0' * 32) == (writebehind.UNKNOWN, None)   # made in 1970
+		writer.close()
+		other.close()
+	finally:
+		store.replace_controls = replace
+
+
+def test_full_queue_pushes_back():
+	''' While the writer is busy, a full queue refuses new submissions '''
+	release = threading.Event()
+	started = threading.Event()
+	replace = store.replace_controls
+	def slow_replace(*args, **kwargs):
+		started.set()
+		release.wait()
+		return replace(*args, **kwargs)
+	store.replace_controls = slow_replace
+	try:
+		writer = WriteBehindQueue(max_pending=1)
+		writer.submit([])            # taken by the writer, which then blocks
+		started.wait()
+		queued = writer.submit([{'control_km': 5}])
+		try:
+			writer.submit([])
+			assert False, 'queue should be full'
+		except QueueFull:
+			pass
+		release.set()
+		writer.flush()
+		assert writer.status(queued)[0] == writebehind.DURABLE
+		writer.close()
+	finally:
+		store.replace_controls = replace
+
+
+def test_failed_write_does_not_stop_writer():
+	''' A submission Mongo cannot store fails on its own; the writer carries on '''
+	writer = WriteBehindQueue()
+	bad = writer.submit([{'control_km': object()}], brevet_id='bad')
+	good = writer.submit([{'control_km': 7}])
+	writer.flush()
+	assert writer.status(bad)[0] == writebehind.FAILED
+	assert writer.status(good)[0] == writebehind.DURABLE
+	later = writer.submit([{'control_km': 8}])
+	writer.flush()
+	assert writer.status(later)[0] == writebehind.DURABLE
+	writer.close()
+
+
+def test_parse_write_concern():
+	assert parse_write_concern(None) is None
+	assert parse_write_concern('majority,j').document == {'w': 'majority', 'j': True}
+	assert parse_write_concern(1).document == {'w': 1}
@@ -0,0 +1,177 @@
+"""
+Write-behind queue for brevet submissions.
+
+submit() queues the (already validated) documents of a whole brevet and
+returns a submission id without waiting for them to be written.  A
+single background thread drains the queue, coalescing submissions for
+the same brevet so that only the newest is written, and records when
+each submission is durable (written with the configured write concern)
+or has failed.  The queue is bounded; when it is full submit() raises
+QueueFull and the caller should ask the client to retry.
+
+The writer thread records each outcome in Mongo as well
+(store.set_submission_status), so that with several gunicorn workers a
+poll reaching a worker other than the one that queued the submission
+still gets an answer; submit() itself never waits on Mongo.  Each
+worker keeps the statuses of its own submissions in memory and answers
+for those without asking Mongo.  A submission id carries the time it
+was made, so a recent id that no worker has recorded an outcome for yet
+is pending, and an old one is unknown.
+"""
+import atexit
+import logging
+import queue
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pymongo import WriteConcern
+from pymongo.errors import PyMongoError
+from brevetlib import store
+
+log = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DURABLE = 'durable'
+FAILED = 'failed'
+UNKNOWN = 'unknown'
+
+QueueFull = queue.Full
+
+# Submission ids: milliseconds since the epoch (11 hex digits), then random
+_ID = re.compile(r'[0-9a-f]{32}\Z')
+
+
+def parse_write_concern(value):
+    """
+    A WriteConcern from a configuration value: 'majority', a number of
+    nodes (0 = unacknowledged), optionally followed by ',j' to also wait
+    for the journal -- e.g. 'majority,j'.  None gives the default.
+    """
+    if value is None or value == '':
+        return None
+    parts = [part.strip() for part in str(value).split(',')]
+    w = int(parts[0]) if parts[0].isdigit() else parts[0]
+    return WriteConcern(w=w, j=True if 'j' in parts[1:] else None)
+
+
+class WriteBehindQueue:
+    def __init__(self, max_pending=100, write_concern=None, keep_statuses=10000,
+                 pending_for=600):
+        self.write_concern = write_concern
+        self.keep_statuses = keep_statuses
+        self.pending_for = pending_for   # seconds an unrecorded id counts as pending
+        self._queue = queue.Queue(max_pending)
+        self._statuses = OrderedDict()   # submission id -> (status, detail)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='brevet-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, controls, brevet_id=store.DEFAULT_BREVET_ID):
+        """
+        Queue a replacement of brevet_id by controls (an empty list
+        clears it).  Returns the submission id; raises QueueFull.
+        """
+        submission = '{:011x}{}'.format(int(time.time() * 1000), uuid.uuid4().hex[:21])
+        self._set(submission, PENDING)
+        try:
+            self._queue.put_nowait((submission, brevet_id, controls))
+        except queue.Full:
+            with self._lock:
+                del self._statuses[submission]
+            raise
+        return submission
+
+    def status(self, submission):
+        """Returns (status, detail); detail is the brevet version once durable."""
+        with self._lock:
+            if submission in self._statuses:
+                return self._statuses[submission]
+        # Queued by another worker, or too old to be kept here
+        try:
+            recorded = store.submission_status(submission)
+        except PyMongoError as err:
+            log.warning("Could not read submission %s: %s", submission, err)
+            recorded = None
+        if recorded:
+            return recorded
+        if _ID.match(submission):
+            age = time.time() - int(submission[:11], 16) / 1000
+            if 0 <= age < self.pending_for:
+                return (PENDING, None)
+        return (UNKNOWN, None)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _set(self, submission, status, detail=None):
+        with self._lock:
+            self._statuses[submission] = (status, detail)
+            self._statuses.move_to_end(submission)
+            while len(self._statuses) > self.keep_statuses:
+                self._statuses.popitem(last=False)
+
+    def _set_all(self, submissions, status, detail=None):
+        for submission in submissions:
+            self._set(submission, status, detail)
+        try:
+            store.set_submission_status(submissions, status, detail)
+        except PyMongoError as err:
+            log.warning("Could not record the status of %d submissions: %s", len(submissions), err)
+
+    def _take_batch(self):
+        """Blocks for one submission, then takes whatever else is queued."""
+        batch = [self._queue.get()]
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                self._write(batch)
+            finally:
+                # flush() must return even if a write blew up
+                for _ in batch:
+                    self._queue.task_done()
+            if None in batch:
+                return
+
+    def _write(self, batch):
+        # Newest submission per brevet wins; the others are superseded
+        newest = OrderedDict()
+        for item in batch:
+            if item is None:
+                continue
+            submission, brevet_id, controls = item
+            newest.setdefault(brevet_id, []).append((submission, controls))
+        for brevet_id, submissions in newest.items():
+            ids = [submission for submission, _ in submissions]
+            try:
+                version = store.replace_controls(submissions[-1][1], brevet_id,
+                                                 write_concern=self.write_concern)
+            except PyMongoError as err:
+                log.error("Write-behind of brevet %s failed: %s", brevet_id, err)
+                self._set_all(ids, FAILED, str(err))
+            except Exception as err:
+                # Not Mongo's fault (e.g. a document it cannot encode); the
+                # writer thread must survive it all the same
+                log.exception("Write-behind of brevet %s failed", brevet_id)
+                self._set_all(ids, FAILED, str(err))
+            else:
+                self._set_all(ids, DURABLE, version)
+
+    def flush(self):
+        """Blocks until everything queued so far has been written (or failed)."""
+        self._queue.join()
+
+    def close(self):
+        """Write what is queued and stop the writer thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()